@@ -1,20 +1,35 @@
-from fastapi import FastAPI, UploadFile, Request, HTTPException,BackgroundTasks, File, Depends
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, HTTPException, Depends, Query
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
 from functools import lru_cache 
 from langchain_huggingface.embeddings import HuggingFaceEmbeddings
-import shutil
 from app.services.document_ingester import Ingester
 from app.services.retriever import Retriever
 from app.services.generation import Generation
-from app.services.database import Database
+from app.services.database import Database, DOCUMENT_STATUSES, JOB_STATUSES, document_metadata
+from app.services.ingest_worker import IngestWorkerPool
+from app.services.reconciler import Reconciler
+from app.services.uploads import SUPPORTED_EXTENSIONS, MalformedUpload, UploadTooLarge, discard_upload, keep_upload, save_upload, save_uploads, save_upload_stream, is_archive, iter_archive
+from app.services.cache import ResponseCache
+from app.services.embeddings import CachedEmbeddings, configure_torch_threads
+from app.services.embedding_batcher import BULK, INTERACTIVE, EmbeddingBatcher
+from app.services.context_builder import ContextBuilder
+from app.services.tokens import estimate_tokens
+from app.services.metrics import CACHE_LOOKUPS, INGEST_QUEUE_DEPTH, LLM_TOKENS, REQUEST_SECONDS, collect_timings
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
 from pydantic import BaseModel
+from datetime import datetime, timezone
+from typing import Literal, Optional
 from werkzeug.utils import secure_filename
 from dotenv import load_dotenv
 import os
 import time
 import logging
+import threading
 import json
+import httpx
+import asyncio
 
 # --- Structured Logging Setup ---
 class JSONFormatter(logging.Formatter):
@@ -39,13 +54,62 @@ handler.setFormatter(JSONFormatter())
 logger.addHandler(handler)
 #--- Lifecycle Management ---
 database = Database()
+response_cache = ResponseCache()
+startup_state = {"ready": False, "error": None, "phases": {}}
+EMBED_MICROBATCH_ENABLED = os.getenv("EMBED_MICROBATCH_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# A writer owns ingestion, index writes and maintenance; readers (API workers in multi-worker mode) serve chat
+# and reads against the writer's Chroma server and forward uploads and index mutations to the writer.
+APP_ROLES = ("writer", "reader")
+APP_ROLE = os.getenv("APP_ROLE", "writer")
+WRITER_URL = os.getenv("WRITER_URL")
+if APP_ROLE not in APP_ROLES:
+    raise ValueError(f"APP_ROLE must be one of {APP_ROLES}, got '{APP_ROLE}'.")
+if APP_ROLE == "reader" and not (os.getenv("CHROMA_HOST") and WRITER_URL and os.getenv("VECTOR_BACKEND", "chroma") == "chroma"):
+    raise ValueError("APP_ROLE=reader needs CHROMA_HOST, WRITER_URL and the chroma vector backend.")
+
+def run_startup_phase(name, func):
+    start_time = time.perf_counter()
+    result = func()
+    duration_ms = round((time.perf_counter() - start_time) * 1000, 2)
+    startup_state["phases"][name] = duration_ms
+    logger.info(f"Startup phase '{name}' completed", extra={"extra": {"phase": name, "duration_ms": duration_ms}})
+    return result
+
+def warm_up():
+    # Model loading and ingest recovery run off the event loop so the server accepts requests immediately.
+    try:
+        run_startup_phase("load_embedding_model", get_embed_model)
+        run_startup_phase("init_retriever", get_retriever)
+        run_startup_phase("init_generator", get_generator)
+        if APP_ROLE == "writer":
+            run_startup_phase("init_ingester", get_ingester)
+            run_startup_phase("sync_lexical_index", lambda: get_ingester().sync_lexical_index())
+            run_startup_phase("backfill_chunk_metadata", backfill_chunk_metadata)
+            run_startup_phase("resume_ingest_jobs", resume_ingest_jobs)
+            run_startup_phase("start_ingest_pool", lambda: get_ingest_pool().start())
+            if RECONCILE_INTERVAL_SECONDS > 0:
+                threading.Thread(target=run_periodic_reconciliation, name="reconciler", daemon=True).start()
+            run_startup_phase("purge_expired_sessions", purge_expired_sessions)
+            if SESSION_PURGE_INTERVAL_SECONDS > 0:
+                threading.Thread(target=run_periodic_session_purge, name="session-purge", daemon=True).start()
+        startup_state["ready"] = True
+        logger.info("Application is ready", extra={"extra": {"startup_phases_ms": startup_state["phases"]}})
+    except Exception as e:
+        startup_state["error"] = str(e)
+        logger.error(f"Application startup failed: {e}", exc_info=True)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting up the application...")
     logger.info("Database connection established.")
     load_dotenv()
-    ingest_uploaded_docs()
+    threading.Thread(target=warm_up, name="startup", daemon=True).start()
     yield
+    if startup_state["ready"] and APP_ROLE == "writer":
+        get_ingest_pool().stop()
+    if get_embed_batcher.cache_info().currsize:
+        get_embed_batcher().stop()
     database.disconnect()
     logger.info("Database connection closed. Application shutdown complete.")
     logger.info("Application has been stopped.")
@@ -53,12 +117,53 @@ async def lifespan(app: FastAPI):
 # --- FastAPI App ---
 app = FastAPI(lifespan=lifespan)
 
+# --- Middleware for Routing Writes ---
+WRITER_ROUTES = {
+    ("POST", "/document"), ("POST", "/documents/bulk"), ("DELETE", "/document"), ("POST", "/maintenance/reconcile")
+}
+
+@app.middleware("http")
+async def forward_writes(request: Request, call_next):
+    # Checked before routing, so a reader never builds an Ingester for a request it hands to the writer.
+    # Uploads are streamed through as they arrive, so the writer alone stores files and registers documents.
+    if APP_ROLE != "reader" or (request.method, request.url.path) not in WRITER_ROUTES:
+        return await call_next(request)
+    headers = {"content-type": request.headers.get("content-type", "application/json")}
+    if "content-length" in request.headers:
+        headers["content-length"] = request.headers["content-length"]
+    async with httpx.AsyncClient(base_url=WRITER_URL, timeout=None) as client:
+        forwarded = await client.request(
+            request.method, request.url.path,
+            params=request.query_params,
+            content=request.stream(),
+            headers=headers
+        )
+    return Response(forwarded.content, status_code=forwarded.status_code, media_type=forwarded.headers.get("content-type"))
+
+# --- Middleware for Upload Size Limits ---
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_MB", "200")) * 1024 * 1024
+MAX_BULK_UPLOAD_BYTES = int(os.getenv("MAX_BULK_UPLOAD_MB", "4096")) * 1024 * 1024
+MAX_BULK_UPLOAD_FILES = int(os.getenv("MAX_BULK_UPLOAD_FILES", "10000"))
+UPLOAD_LIMITS = {("POST", "/document"): MAX_UPLOAD_BYTES, ("POST", "/documents/bulk"): MAX_BULK_UPLOAD_BYTES}
+
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    # Runs before routing, so an oversized Content-Length is rejected before any of the body is read.
+    max_bytes = UPLOAD_LIMITS.get((request.method, request.url.path))
+    content_length = request.headers.get("content-length")
+    if max_bytes and content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        return JSONResponse(status_code=413, content={"message": f"Upload exceeds the maximum size of {max_bytes} bytes."})
+    return await call_next(request)
+
 # --- Middleware for Request Logging ---
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
     start_time = time.perf_counter()
     response = await call_next(request)
     process_time = (time.perf_counter() - start_time) * 1000
+    # The route template keeps per-id paths such as /sessions/{session_id} in a single series.
+    route = request.scope.get("route")
+    REQUEST_SECONDS.labels(request.method, route.path if route else "unmatched", response.status_code).observe(process_time / 1000)
     logger.info(
         f"{request.method} {request.url.path}",
         extra={"extra": {"method": request.method, "path": request.url.path, "status_code": response.status_code, "duration_ms": round(process_time, 2)}}
@@ -79,81 +184,458 @@ async def http_exception_handler(request: Request, exc: HTTPException):
     return JSONResponse(status_code=exc.status_code, content={"message": exc.detail})
 
 # --- Dependency Injection ---
-embed_model = HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+@lru_cache()
+def get_base_embed_model():
+    # Loaded once per process; in multi-worker mode each worker gets its share of the cores.
+    threads = configure_torch_threads()
+    logger.info(f"Loading the embedding model with {threads} torch threads", extra={"extra": {"app_role": APP_ROLE, "torch_threads": threads}})
+    return HuggingFaceEmbeddings(model_name="sentence-transformers/all-MiniLM-L6-v2")
+
+@lru_cache()
+def get_embed_batcher():
+    return EmbeddingBatcher(get_base_embed_model())
+
+@lru_cache()
+def get_embed_model():
+    # Chat queries; concurrent requests share forward passes and go ahead of queued ingest slices.
+    if EMBED_MICROBATCH_ENABLED:
+        return CachedEmbeddings(get_embed_batcher().client(INTERACTIVE))
+    return CachedEmbeddings(get_base_embed_model())
+
+@lru_cache()
+def get_ingest_embed_model():
+    if EMBED_MICROBATCH_ENABLED:
+        return CachedEmbeddings(get_embed_batcher().client(BULK))
+    return get_embed_model()
 
 @lru_cache()
 def get_ingester():
-    return Ingester(embedding_model=embed_model)
+    return Ingester(embedding_model=get_ingest_embed_model())
+
+@lru_cache()
+def get_context_builder():
+    return ContextBuilder()
 
 @lru_cache()
 def get_retriever():
-    return Retriever(embedding_model=embed_model)
+    return Retriever(embedding_model=get_embed_model(), context_builder=get_context_builder())
 
 @lru_cache()
 def get_generator():
     return Generation()
 
-# --- Background Tasks ---
-def ingest_documents(path:str):
-    ingester=get_ingester()
-    logger.info(f"Starting document ingestion for {path}", extra={"extra": {"document_path": path}})
-    ingester.ingest_documents(path)
-    logger.info(f"Document ingestion completed for {path}", extra={"extra": {"document_path": path}})
-    database.update_document_status(path, "ingested")
-    logger.info(f"Document status updated to 'ingested' for {path}", extra={"extra": {"document_path": path}})
-
-def ingest_uploaded_docs():
-    to_be_ingested = database.list_documents()
-    for doc in to_be_ingested:
-        if doc[1] == "uploaded":
-            ingest_documents(doc[3])
-            logger.info(f"Background ingestion completed for {doc[3]}", extra={"extra": {"document_path": doc[3]}})
+@lru_cache()
+def get_reconciler():
+    return Reconciler(get_ingester(), database, os.path.join(os.getenv("DATA_DIR"), "uploads"))
+
+@lru_cache()
+def get_ingest_pool():
+    return IngestWorkerPool(get_ingester(), on_ingested=finish_ingestion)
+
+# --- Ingestion ---
+def finish_ingestion(job: dict, summary: dict):
+    previous_path = job["previous_path"]
+    if previous_path:
+        # The new version has taken over the previous version's unchanged chunks.
+        try:
+            os.remove(previous_path)
+        except FileNotFoundError:
+            logger.warning(f"Previous version {previous_path} not found for deletion.")
+        database.delete_document(previous_path)
+        logger.info(f"Replaced previous version {previous_path}", extra={"extra": {"document_path": job["path"], "previous_path": previous_path}})
+    database.bump_corpus_version()
+
+CHUNK_METADATA_VERSION = 1
+
+def backfill_chunk_metadata():
+    # Chunks ingested before document ids and upload times were recorded cannot be filtered until stamped.
+    if database.get_metadata_value("chunk_metadata_version") >= CHUNK_METADATA_VERSION:
+        return
+    documents = database.list_ingested_documents()
+    get_ingester().backfill_document_metadata([(row[3], document_metadata(row)) for row in documents])
+    database.set_metadata_value("chunk_metadata_version", CHUNK_METADATA_VERSION)
+
+RECONCILE_INTERVAL_SECONDS = float(os.getenv("RECONCILE_INTERVAL_SECONDS", "0"))
+
+def reconcile_storage(dry_run: bool = False):
+    summary = get_reconciler().run(dry_run=dry_run)
+    if not dry_run and (summary["orphan_rows"] or summary["orphan_vectors"]):
+        database.bump_corpus_version()
+    return summary
+
+def run_periodic_reconciliation():
+    while True:
+        time.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            reconcile_storage()
+        except Exception as e:
+            logger.error(f"Periodic reconciliation failed: {e}", exc_info=True)
+
+# Expired sessions are purged by the writer at startup and on a timer, not only when a session is created,
+# so deployments that keep reusing their sessions still drop the abandoned ones.
+SESSION_RETENTION_SECONDS = int(os.getenv("SESSION_RETENTION_DAYS", "30")) * 24 * 3600
+SESSION_PURGE_INTERVAL_SECONDS = float(os.getenv("SESSION_PURGE_INTERVAL_SECONDS", "3600"))
+
+def purge_expired_sessions():
+    purged = database.purge_expired_sessions(SESSION_RETENTION_SECONDS)
+    if purged:
+        logger.info("Expired chat sessions purged", extra={"extra": {"purged_sessions": purged}})
+    return purged
+
+def run_periodic_session_purge():
+    while True:
+        time.sleep(SESSION_PURGE_INTERVAL_SECONDS)
+        try:
+            purge_expired_sessions()
+        except Exception as e:
+            logger.error(f"Periodic session purge failed: {e}", exc_info=True)
+
+def resume_ingest_jobs():
+    requeued = database.requeue_interrupted_jobs()
+    pending = database.list_unqueued_documents()
+    for filename, path in pending:
+        database.enqueue_job(path, document_key=filename)
+    logger.info("Resumed pending ingestion jobs", extra={"extra": {"interrupted_jobs": requeued, "unqueued_documents": len(pending)}})
 
 # --- API Endpoints ---
+def require_ready():
+    if not startup_state["ready"]:
+        raise HTTPException(status_code=503, detail="Service is starting up, please retry shortly.")
+
 @app.get("/")
 async def health_check():
     return {"status": "ok"}
 
-@app.post("/document")
-async def upload_file(background_tasks: BackgroundTasks,file:UploadFile=File(...) ):
+@app.get("/metrics")
+def metrics():
+    INGEST_QUEUE_DEPTH.set(database.queue_depth())
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # In multi-worker mode every process writes its samples there, so any worker's scrape covers them all.
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+@app.get("/ready")
+async def readiness_check():
+    if startup_state["ready"]:
+        return {"status": "ready", "startup_phases_ms": startup_state["phases"]}
+    status = "failed" if startup_state["error"] else "starting"
+    return JSONResponse(
+        status_code=503,
+        content={"status": status, "error": startup_state["error"], "startup_phases_ms": startup_state["phases"]}
+    )
+
+def register_upload(filename: str, safe_filename: str, file_path: str, content_hash: str, batch_id: int = None):
+    duplicate = database.find_document_by_hash(content_hash)
+    if duplicate:
+        os.remove(file_path)
+        logger.info(f"Skipping duplicate upload: {filename}", extra={"extra": {"original_filename": filename, "duplicate_of": duplicate[3]}})
+        return {"filename": filename, "message": "File already uploaded.", "duplicate_of": duplicate[3]}
+
+    previous = database.find_document_by_filename(safe_filename)
+    database.add_document(filename=safe_filename, path=file_path, content_hash=content_hash)
+    logger.info(f"Uploading file: {filename}", extra={"extra": {"original_filename": filename, "safe_path": file_path, "batch_id": batch_id}})
+    job_id = database.enqueue_job(file_path, document_key=safe_filename, previous_path=previous[3] if previous else None, batch_id=batch_id)
+    return {"filename": filename, "message": "File uploaded successfully.", "job_id": job_id}
+
+UPLOAD_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["file"], "properties": {"file": {"type": "string", "format": "binary"}}
+}}}}}
+
+@app.post("/document", openapi_extra=UPLOAD_FORM_SCHEMA)
+async def upload_file(request: Request):
+    # The body is read here rather than through File(...), which would spool the whole upload before this runs.
     upload_dir = os.path.join(os.getenv("DATA_DIR"), "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
+    try:
+        filename, safe_filename, file_path, content_hash = await save_upload(request, upload_dir, MAX_UPLOAD_BYTES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await run_in_threadpool(register_upload, filename, safe_filename, file_path, content_hash)
+
+BULK_UPLOAD_FORM_SCHEMA = {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+    "type": "object", "required": ["files"],
+    "properties": {"files": {"type": "array", "items": {"type": "string", "format": "binary"}}}
+}}}}}
+
+def register_bulk_upload(parts: list[dict], upload_dir: str):
+    batch_id = database.create_batch()
+    results = []
+    seen = set()
+
+    def accept(filename):
+        safe_filename = secure_filename(filename)
+        if not safe_filename.lower().endswith(SUPPORTED_EXTENSIONS):
+            results.append({"filename": filename, "message": "Unsupported file type, skipped."})
+        elif safe_filename in seen:
+            results.append({"filename": filename, "message": "Duplicate filename in this upload, skipped."})
+        else:
+            seen.add(safe_filename)
+            return True
+        return False
 
-    safe_filename = secure_filename(file.filename)
-    file_path = os.path.join(upload_dir, f"{os.path.splitext(safe_filename)[0]}_{int(time.time())}{os.path.splitext(safe_filename)[1]}")
+    try:
+        for part in parts:
+            filename = part["filename"]
+            if part["too_large"]:
+                results.append({"filename": filename, "message": "File exceeds the maximum upload size, skipped."})
+            elif is_archive(filename):
+                with open(part["tmp_path"], "rb") as archive:
+                    for member_name, stream in iter_archive(archive, filename):
+                        # Archive members count towards the same file limit as the parts of the request.
+                        if len(results) >= MAX_BULK_UPLOAD_FILES:
+                            results.append({"filename": filename, "message": f"More than {MAX_BULK_UPLOAD_FILES} files in this upload, the rest of the archive was skipped."})
+                            break
+                        if not accept(member_name):
+                            continue
+                        try:
+                            saved = save_upload_stream(stream, member_name, upload_dir, MAX_UPLOAD_BYTES)
+                        except UploadTooLarge:
+                            results.append({"filename": member_name, "message": "File exceeds the maximum upload size, skipped."})
+                            continue
+                        results.append(register_upload(member_name, *saved, batch_id=batch_id))
+            elif accept(filename):
+                safe_filename, file_path = keep_upload(part["tmp_path"], upload_dir, filename)
+                results.append(register_upload(filename, safe_filename, file_path, part["sha256"], batch_id=batch_id))
+    finally:
+        # Kept files have already moved to their final path; archives and skipped parts are removed here.
+        for part in parts:
+            if part["tmp_path"]:
+                discard_upload(part["tmp_path"])
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
-    database.add_document(filename=safe_filename, path=file_path)
-    logger.info(f"Uploading file: {file.filename}", extra={"extra": {"original_filename": file.filename, "safe_path": file_path}})
-    background_tasks.add_task(ingest_documents, path=file_path)
-    return {"filename": file.filename, "message": "File uploaded successfully."}
+    accepted = sum(1 for result in results if "job_id" in result)
+    logger.info("Bulk upload received", extra={"extra": {"batch_id": batch_id, "accepted": accepted, "received": len(results)}})
+    return {"batch_id": batch_id, "accepted": accepted, "files": results}
+
+@app.post("/documents/bulk", openapi_extra=BULK_UPLOAD_FORM_SCHEMA)
+async def bulk_upload(request: Request):
+    # Like /document, the body is streamed here instead of being spooled by File(...). Parts are kept as temp
+    # files under running byte and file limits and only registered once the whole body has arrived.
+    upload_dir = os.path.join(os.getenv("DATA_DIR"), "uploads")
+    try:
+        parts = await save_uploads(request, upload_dir, MAX_UPLOAD_BYTES, MAX_BULK_UPLOAD_BYTES, MAX_BULK_UPLOAD_FILES)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not parts:
+        raise HTTPException(status_code=400, detail="The request has no file in the 'files' field.")
+    return await run_in_threadpool(register_bulk_upload, parts, upload_dir)
+
+@app.get("/documents/bulk/{batch_id}")
+def bulk_progress(batch_id: int):
+    progress = database.get_batch_progress(batch_id)
+    if progress is None:
+        raise HTTPException(status_code=404, detail="Batch not found.")
+    return progress
 
 @app.get("/documents")
-def list_documents():
-    documents = database.list_documents()
-    logger.info("Fetched document list", extra={"extra": {"document_count": len(documents)}})
-    return {"documents": documents}
+def list_documents(
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    q: Optional[str] = None,
+    status: Optional[Literal[DOCUMENT_STATUSES]] = None
+):
+    try:
+        documents, next_cursor = database.list_documents(cursor=cursor, limit=limit, query=q, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    logger.info("Fetched document list", extra={"extra": {"document_count": len(documents), "query": q, "status": status}})
+    return {"documents": documents, "next_cursor": next_cursor}
+
+@app.get("/jobs")
+def list_jobs(status: Optional[Literal[JOB_STATUSES]] = None, limit: int = Query(100, ge=1, le=1000)):
+    return {"jobs": database.list_jobs(status=status, limit=limit), "queue_depth": database.queue_depth()}
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: int):
+    job = database.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
 
 class DeleteRequest(BaseModel):
     source: str
 
-@app.delete("/document")
+@app.delete("/document", dependencies=[Depends(require_ready)])
 def clear_document(payload: DeleteRequest, ingester: Ingester = Depends(get_ingester)):
     logger.info(f"Deleting document: {payload.source}")
-    message = ingester.delete_document(payload.source)
+    message = ingester.delete_document(payload.source, chunk_ids=database.list_document_chunks(payload.source))
     logger.info(f"Vector deletion completed for: {payload.source,message}")
     db_msg=database.delete_document(payload.source)
+    database.bump_corpus_version()
     logger.info(f"Document deletion completed for: {payload.source}")
     return {"message": message, "db_msg": db_msg}
 
+@app.post("/maintenance/reconcile", dependencies=[Depends(require_ready)])
+def reconcile(dry_run: bool = False):
+    return reconcile_storage(dry_run=dry_run)
+
+def prompt_token_usage(question: str, retrieval_data: dict, history_data: dict):
+    usage = {
+        "question_tokens": estimate_tokens(question),
+        "context_tokens": retrieval_data["context_tokens"],
+        "history_tokens": history_data["history_tokens"]
+    }
+    usage["prompt_tokens"] = sum(usage.values())
+    for part in ("question", "context", "history"):
+        LLM_TOKENS.labels(part).inc(usage[f"{part}_tokens"])
+    return usage
+
+class ChatFilters(BaseModel):
+    document_ids: Optional[list[int]] = None
+    uploaded_after: Optional[datetime] = None
+    uploaded_before: Optional[datetime] = None
+
+    @staticmethod
+    def _epoch(value: Optional[datetime]):
+        # Upload times are recorded in UTC, so naive datetimes are read as UTC too.
+        if value is None:
+            return None
+        return (value if value.tzinfo else value.replace(tzinfo=timezone.utc)).timestamp()
+
+    def to_retrieval_filters(self):
+        filters = {
+            "document_ids": self.document_ids,
+            "uploaded_after": self._epoch(self.uploaded_after),
+            "uploaded_before": self._epoch(self.uploaded_before),
+        }
+        # An explicitly empty document_ids list is kept: it scopes the search to no documents at all.
+        return {key: value for key, value in filters.items() if value is not None} or None
+
 class ChatRequest(BaseModel):
     question: str
-    history: str
+    history: Optional[str] = None
+    session_id: Optional[str] = None
+    rewrite_mode: Optional[Literal["off", "always", "adaptive", "pipelined"]] = None
+    filters: Optional[ChatFilters] = None
+
+    def retrieval_filters(self):
+        return self.filters.to_retrieval_filters() if self.filters else None
+
+def cache_scope(history: str, filters: dict, rewrite_mode: str):
+    # Answers are only reused for the same history, rewrite mode and retrieval scope.
+    return f"{history}\0{rewrite_mode}\0{json.dumps(filters, sort_keys=True) if filters else ''}"
+
+# --- Sessions ---
+@app.post("/sessions")
+def create_session():
+    purged = database.purge_expired_sessions(SESSION_RETENTION_SECONDS)
+    session_id = database.create_session()
+    logger.info("Chat session created", extra={"extra": {"session_id": session_id, "purged_sessions": purged}})
+    return {"session_id": session_id}
+
+@app.get("/sessions/{session_id}")
+def get_session(session_id: str):
+    if not database.session_exists(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found.")
+    return {"session_id": session_id, "messages": database.list_messages(session_id)}
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    if not database.delete_session(session_id):
+        raise HTTPException(status_code=404, detail=f"Session {session_id} not found.")
+    return {"message": f"Session {session_id} deleted."}
+
+async def resolve_history(request: ChatRequest):
+    """Returns (history, messages left out before it, key of the conversation state for the response cache)."""
+    # Session turns are loaded server-side; clients without a session may still send the history themselves.
+    if request.session_id is None:
+        return request.history or "", 0, request.history or ""
+    if not await run_in_threadpool(database.session_exists, request.session_id):
+        raise HTTPException(status_code=404, detail=f"Session {request.session_id} not found.")
+    # Only the turns after the cached summary (or that fit the budget) are read, so a turn costs the same
+    # however long the session is. Sessions are append-only, so their length identifies their state.
+    skip, max_chars = get_context_builder().history_window(request.session_id)
+    messages, total = await run_in_threadpool(database.list_recent_messages, request.session_id, skip, max_chars)
+    return messages, total - len(messages), f"session:{request.session_id}:{total}" if total else ""
 
-@app.post("/chat")
+def lookup_cached_answer(question: str, scope: str, corpus_version: int, question_embedding):
+    cached = response_cache.get(question, scope, corpus_version, question_embedding)
+    CACHE_LOOKUPS.labels("response", "miss" if cached is None else "hit").inc()
+    return cached
+
+async def gather_context(request: ChatRequest, retriever: Retriever, history, filters: dict, question_embedding=None, history_offset: int = 0):
+    # Retrieval and history compaction run concurrently; their spans are returned for the chat log line.
+    with collect_timings() as stages:
+        retrieval_data, history_data = await asyncio.gather(
+            retriever.aretrieve_context(request.question, request.rewrite_mode, filters=filters, query_embedding=question_embedding),
+            get_context_builder().abuild_history(history, request.question, conversation_id=request.session_id, offset=history_offset)
+        )
+    return retrieval_data, history_data, stages
+
+async def record_turn(request: ChatRequest, result: dict):
+    if request.session_id is not None:
+        await run_in_threadpool(database.add_messages, request.session_id, [
+            ("user", request.question, None),
+            ("assistant", result["response"], result["citations"])
+        ])
+
+@app.post("/chat", dependencies=[Depends(require_ready)])
 async def chat_endpoint(request: ChatRequest, retriever: Retriever = Depends(get_retriever), generator: Generation = Depends(get_generator)):
-    logger.info(f"Chat request received", extra={"extra": {"question_length": len(request.question)}})
-    retrieval_data = retriever.retrieve_context(request.question)
-    response = generator.generate_response(request.question, retrieval_data["context"], request.history)
-    return {"response": response, "citations": retrieval_data["citations"]}
+    logger.info(f"Chat request received", extra={"extra": {"question_length": len(request.question), "session_id": request.session_id}})
+    history, history_offset, history_key = await resolve_history(request)
+    filters = request.retrieval_filters()
+    scope = cache_scope(history_key, filters, request.rewrite_mode or retriever.rewrite_mode)
+    corpus_version = await run_in_threadpool(database.get_corpus_version)
+    question_embedding = await run_in_threadpool(get_embed_model().embed_query, request.question)
+    cached = lookup_cached_answer(request.question, scope, corpus_version, question_embedding)
+    if cached is not None:
+        logger.info("Chat response served from cache", extra={"extra": {"cache_hit": True}})
+        await record_turn(request, cached)
+        return cached
+
+    retrieval_data, history_data, stages = await gather_context(request, retriever, history, filters, question_embedding, history_offset)
+    generation_start = time.perf_counter()
+    response = await generator.agenerate_response(request.question, retrieval_data["context"], history_data["history"])
+    generation_ms = round((time.perf_counter() - generation_start) * 1000, 2)
+    LLM_TOKENS.labels("completion").inc(estimate_tokens(response))
+    logger.info("Chat response generated", extra={"extra": {"cache_hit": False, **retrieval_data["timings"], "generation_ms": generation_ms, "stages_ms": stages, **prompt_token_usage(request.question, retrieval_data, history_data)}})
+    result = {"response": response, "citations": retrieval_data["citations"]}
+    response_cache.put(request.question, scope, corpus_version, result, question_embedding)
+    await record_turn(request, result)
+    return result
+
+@app.post("/chat/stream", dependencies=[Depends(require_ready)])
+async def chat_stream_endpoint(request: ChatRequest, retriever: Retriever = Depends(get_retriever), generator: Generation = Depends(get_generator)):
+    logger.info(f"Streaming chat request received", extra={"extra": {"question_length": len(request.question), "session_id": request.session_id}})
+    history, history_offset, history_key = await resolve_history(request)
+    filters = request.retrieval_filters()
+    scope = cache_scope(history_key, filters, request.rewrite_mode or retriever.rewrite_mode)
+    corpus_version = await run_in_threadpool(database.get_corpus_version)
+    question_embedding = await run_in_threadpool(get_embed_model().embed_query, request.question)
+    cached = lookup_cached_answer(request.question, scope, corpus_version, question_embedding)
+
+    # Newline-delimited JSON events: citations first, then tokens as they arrive, then done.
+    async def cached_stream():
+        logger.info("Chat response served from cache", extra={"extra": {"cache_hit": True}})
+        yield json.dumps({"type": "citations", "citations": cached["citations"]}) + "\n"
+        yield json.dumps({"type": "token", "content": cached["response"]}) + "\n"
+        await record_turn(request, cached)
+        yield json.dumps({"type": "done"}) + "\n"
+
+    async def event_stream():
+        tokens = []
+        try:
+            retrieval_data, history_data, stages = await gather_context(request, retriever, history, filters, question_embedding, history_offset)
+            yield json.dumps({"type": "citations", "citations": retrieval_data["citations"]}) + "\n"
+            generation_start = time.perf_counter()
+            async for token in generator.astream_response(request.question, retrieval_data["context"], history_data["history"]):
+                tokens.append(token)
+                yield json.dumps({"type": "token", "content": token}) + "\n"
+            generation_ms = round((time.perf_counter() - generation_start) * 1000, 2)
+            LLM_TOKENS.labels("completion").inc(estimate_tokens("".join(tokens)))
+            logger.info("Chat response generated", extra={"extra": {"cache_hit": False, **retrieval_data["timings"], "generation_ms": generation_ms, "stages_ms": stages, **prompt_token_usage(request.question, retrieval_data, history_data)}})
+        except Exception as e:
+            logger.error(f"Streaming generation failed: {e}", exc_info=True)
+            yield json.dumps({"type": "error", "message": "An unexpected internal server error occurred."}) + "\n"
+            return
+        result = {"response": "".join(tokens), "citations": retrieval_data["citations"]}
+        response_cache.put(request.question, scope, corpus_version, result, question_embedding)
+        await record_turn(request, result)
+        yield json.dumps({"type": "done"}) + "\n"
+
+    stream = cached_stream() if cached is not None else event_stream()
+    return StreamingResponse(stream, media_type="application/x-ndjson")
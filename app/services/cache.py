@@ -0,0 +1,89 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import numpy as np
+import hashlib
+import threading
+import time
+import os
+
+class ResponseCache:
+    def __init__(self, max_size:int=None, ttl_seconds:float=None, similarity_threshold:float=None):
+        load_dotenv()
+        self.max_size = max_size if max_size is not None else int(os.getenv("CACHE_MAX_SIZE", "512"))
+        self.ttl_seconds = ttl_seconds if ttl_seconds is not None else float(os.getenv("CACHE_TTL_SECONDS", "3600"))
+        self.similarity_threshold = similarity_threshold if similarity_threshold is not None else float(
+            os.getenv("CACHE_SIMILARITY_THRESHOLD", "0.95")
+        )
+        self.entries = OrderedDict()
+        self.corpus_version = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalize(question: str):
+        return " ".join(question.lower().split())
+
+    def _keys(self, question: str, history: str):
+        history_hash = hashlib.sha256((history or "").encode("utf-8")).hexdigest()
+        key = hashlib.sha256(f"{self.normalize(question)}\0{history_hash}".encode("utf-8")).hexdigest()
+        return key, history_hash
+
+    def _sync_version(self, corpus_version: int):
+        # Any change to the corpus invalidates every cached answer.
+        if corpus_version != self.corpus_version:
+            self.entries.clear()
+            self.corpus_version = corpus_version
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for key in [k for k, entry in self.entries.items() if entry["expires_at"] <= now]:
+            del self.entries[key]
+
+    def get(self, question: str, history: str, corpus_version: int, embedding=None):
+        key, history_hash = self._keys(question, history)
+        with self.lock:
+            self._sync_version(corpus_version)
+            self._evict_expired()
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                return self.entries[key]["value"]
+            if embedding is None:
+                return None
+
+            candidates = [
+                (k, entry) for k, entry in self.entries.items()
+                if entry["history_hash"] == history_hash and entry["embedding"] is not None
+            ]
+            if not candidates:
+                return None
+            query = self._unit(embedding)
+            scores = np.stack([entry["embedding"] for _, entry in candidates]) @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.similarity_threshold:
+                return None
+            best_key = candidates[best][0]
+            self.entries.move_to_end(best_key)
+            return self.entries[best_key]["value"]
+
+    def put(self, question: str, history: str, corpus_version: int, value, embedding=None):
+        key, history_hash = self._keys(question, history)
+        with self.lock:
+            self._sync_version(corpus_version)
+            self.entries[key] = {
+                "value": value,
+                "history_hash": history_hash,
+                "embedding": self._unit(embedding) if embedding is not None else None,
+                "expires_at": time.monotonic() + self.ttl_seconds,
+            }
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @staticmethod
+    def _unit(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
@@ -0,0 +1,181 @@
+from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
+from app.services.tokens import CHARS_PER_TOKEN, estimate_tokens
+from app.services.metrics import span
+from dotenv import load_dotenv
+from collections import OrderedDict
+import threading
+import hashlib
+import logging
+import json
+import os
+
+class ContextBuilder:
+    """Fits retrieved chunks and conversation history into the prompt's token budgets."""
+
+    def __init__(self):
+        load_dotenv()
+        self.context_token_budget = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+        self.history_token_budget = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+        self.summarize_history = os.getenv("HISTORY_SUMMARY_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.summary_cache_size = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", "256"))
+        # conversation key -> (messages summarized, hash of those messages, summary)
+        self.summaries = OrderedDict()
+        self.lock = threading.Lock()
+        self.summary_chain = self._summary_chain() if self.summarize_history else None
+        self.logger = logging.getLogger(__name__)
+
+    def _summary_chain(self):
+        template = """Summarize the conversation between a user and an assistant about their documents.
+Keep names, identifiers, numbers and open questions; drop pleasantries. Answer with the summary only.
+Summary so far: {summary}
+New messages:
+{messages}"""
+        prompt = ChatPromptTemplate.from_template(template)
+        llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0)
+        return prompt | llm | StrOutputParser()
+
+    @staticmethod
+    def _normalize(text: str):
+        return " ".join(text.lower().split())
+
+    def build_context(self, chunks: list[Document]):
+        """Formats chunks into the context string, skipping duplicates and chunks that would exceed the budget."""
+        context = ""
+        citations = []
+        seen = set()
+        tokens = 0
+        for doc in chunks:
+            key = hashlib.sha256(self._normalize(doc.page_content).encode("utf-8")).hexdigest()
+            if key in seen:
+                continue
+            source = doc.metadata.get("filename") or os.path.basename(doc.metadata.get("source", "Unknown"))
+            header, footer = f"Context {len(seen)+1} (Source: {source}):\n", f"\n{'-'*50}\n"
+            content = doc.page_content
+            if not seen:
+                # A single oversized chunk is truncated rather than leaving the context empty.
+                content = content[:max(self.context_token_budget * CHARS_PER_TOKEN - len(header) - len(footer), 0)]
+            entry = header + content + footer
+            entry_tokens = estimate_tokens(entry)
+            if tokens + entry_tokens > self.context_token_budget:
+                continue
+            seen.add(key)
+            context += entry
+            tokens += entry_tokens
+            if source not in citations:
+                citations.append(source)
+
+        return {"context": context, "citations": citations, "context_tokens": tokens}
+
+    def _parse_history(self, history, question: str):
+        if isinstance(history, list):
+            messages = history
+        else:
+            try:
+                messages = json.loads(history) if history else []
+            except json.JSONDecodeError:
+                messages = None
+        if not isinstance(messages, list):
+            # Free-form history cannot be split into turns; keep its most recent part.
+            return None, [{"role": "history", "content": history[-self.history_token_budget * CHARS_PER_TOKEN:]}]
+        messages = [m for m in messages if isinstance(m, dict) and m.get("content")]
+        # The client sends the pending question as the last message; it is already in the prompt.
+        if messages and messages[-1].get("role") == "user" and messages[-1]["content"] == question:
+            messages = messages[:-1]
+        return messages, []
+
+    @staticmethod
+    def _format(messages: list[dict]):
+        return "\n".join(f"{m.get('role', 'user')}: {m['content']}" for m in messages)
+
+    @staticmethod
+    def _hash_messages(messages: list[dict]):
+        return hashlib.sha256(json.dumps(messages, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def history_window(self, conversation_id: str):
+        """Returns (messages to skip, characters to load) for reading a stored conversation: only the turns
+        after its cached summary, or only the newest turns that fit the budget when summaries are off."""
+        if not self.summarize_history:
+            return 0, self.history_token_budget * CHARS_PER_TOKEN
+        with self.lock:
+            cached = self.summaries.get(conversation_id)
+        return (cached[0] if cached else 0), None
+
+    def _plan_history(self, history, question: str, conversation_id: str = None, offset: int = 0):
+        """Splits history into recent turns that fit the budget verbatim and older turns that need summarizing.
+
+        history is a JSON string or a list of messages; offset is the number of earlier messages not included.
+        """
+        messages, fallback = self._parse_history(history, question)
+        if messages is None:
+            return None, [], fallback, None
+        # Reserve a quarter of the budget for the summary of older turns.
+        budget = self.history_token_budget * 3 // 4 if self.summarize_history else self.history_token_budget
+        split = len(messages)
+        tokens = 0
+        while split > 0:
+            turn_tokens = estimate_tokens(self._format([messages[split - 1]]))
+            if tokens + turn_tokens > budget:
+                break
+            tokens += turn_tokens
+            split -= 1
+        older, recent = messages[:split], messages[split:]
+        key = conversation_id or (self._hash_messages(messages[:1]) if messages else None)
+        cached = None
+        if older and self.summarize_history:
+            with self.lock:
+                cached = self.summaries.get(key)
+                if cached is not None:
+                    self.summaries.move_to_end(key)
+            # Only reuse a rolling summary whose summarized prefix still matches this conversation. Stored
+            # conversations are append-only and loaded after their summary, so only the count is checked there.
+            if cached is not None and offset:
+                if not offset <= cached[0] <= offset + len(older):
+                    cached = None
+            elif cached is not None and (cached[0] > len(older) or cached[1] != self._hash_messages(older[:cached[0]])):
+                cached = None
+        return key, older, recent, cached
+
+    def _store_summary(self, key: str, older: list[dict], summary: str, offset: int = 0):
+        with self.lock:
+            self.summaries[key] = (offset + len(older), self._hash_messages(older), summary)
+            self.summaries.move_to_end(key)
+            while len(self.summaries) > self.summary_cache_size:
+                self.summaries.popitem(last=False)
+
+    def _render_history(self, summary: str, recent: list[dict]):
+        parts = []
+        if summary:
+            parts.append(f"Summary of earlier conversation: {summary[:self.history_token_budget * CHARS_PER_TOKEN // 4]}")
+        if recent:
+            parts.append(self._format(recent))
+        history = "\n".join(parts)
+        return {"history": history, "history_tokens": estimate_tokens(history)}
+
+    def build_history(self, history, question: str, conversation_id: str = None, offset: int = 0):
+        key, older, recent, cached = self._plan_history(history, question, conversation_id, offset)
+        summary = cached[2] if cached else ""
+        if older and self.summarize_history and (cached is None or cached[0] < offset + len(older)):
+            new_messages = older[cached[0] - offset:] if cached else older
+            try:
+                with span("history_summary"):
+                    summary = self.summary_chain.invoke({"summary": summary or "(none)", "messages": self._format(new_messages)})
+                self._store_summary(key, older, summary, offset)
+            except Exception as e:
+                self.logger.warning(f"History summarization failed, dropping older turns: {e}")
+        return self._render_history(summary, recent)
+
+    async def abuild_history(self, history, question: str, conversation_id: str = None, offset: int = 0):
+        key, older, recent, cached = self._plan_history(history, question, conversation_id, offset)
+        summary = cached[2] if cached else ""
+        if older and self.summarize_history and (cached is None or cached[0] < offset + len(older)):
+            new_messages = older[cached[0] - offset:] if cached else older
+            try:
+                with span("history_summary"):
+                    summary = await self.summary_chain.ainvoke({"summary": summary or "(none)", "messages": self._format(new_messages)})
+                self._store_summary(key, older, summary, offset)
+            except Exception as e:
+                self.logger.warning(f"History summarization failed, dropping older turns: {e}")
+        return self._render_history(summary, recent)
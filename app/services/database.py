@@ -1,55 +1,500 @@
-import sqlite3
+from app.services.storage import get_sqlite_pool
 from dotenv import load_dotenv
+from datetime import datetime, timezone
+import base64
+import json
+import uuid
+import time
+import re
 import os
 
+DOCUMENT_STATUSES = ("uploaded", "queued", "converting", "embedding", "ingested", "failed")
+JOB_STATUSES = ("queued", "converting", "embedding", "ingested", "failed")
+
+def _encode_cursor(timestamp, row_id):
+    return base64.urlsafe_b64encode(f"{timestamp}|{row_id}".encode("utf-8")).decode("ascii")
+
+def _decode_cursor(cursor):
+    try:
+        timestamp, row_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").rsplit("|", 1)
+        return timestamp, int(row_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor '{cursor}'.") from e
+
+def document_metadata(row):
+    """Document-level chunk metadata for a documents row; the upload time is stored as epoch seconds for range filters."""
+    uploaded_at = datetime.strptime(row[2], "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    return {"document_id": row[4], "uploaded_at": uploaded_at}
+
+def _match_expression(query):
+    # Every word in the search box becomes a quoted prefix term, so "annual rep" matches "annual_report_2024.pdf".
+    terms = re.findall(r"\w+", query or "")
+    return " ".join(f'"{term}"*' for term in terms) or None
+
 class Database:
     def __init__(self):
         load_dotenv()
         self.db_path = os.path.join(os.getenv("DATA_DIR"),"sqlite_db/sqlite.db")
-        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.pool = get_sqlite_pool(self.db_path)
         self.create_tables()
     
     def create_tables(self):
-        with self.conn:
-            self.conn.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
+        documents_schema = f"""
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     filename TEXT NOT NULL,
                     path TEXT NOT NULL,
                     status VARCHAR(20) NOT NULL
-                              CHECK(status IN ('uploaded', 'ingested')),
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                              CHECK(status IN ({", ".join(repr(status) for status in DOCUMENT_STATUSES)})),
+                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    content_hash TEXT
+        """
+        with self.pool.exclusive() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS documents ({documents_schema})")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(documents)")]
+            if "content_hash" not in columns:
+                conn.execute("ALTER TABLE documents ADD COLUMN content_hash TEXT")
+            # SQLite cannot alter a CHECK constraint, so older tables are rebuilt with the ingestion states.
+            table_sql = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'documents'").fetchone()[0]
+            if "'queued'" not in table_sql:
+                conn.execute("ALTER TABLE documents RENAME TO documents_old")
+                conn.execute(f"CREATE TABLE documents ({documents_schema})")
+                conn.execute("""
+                    INSERT INTO documents (id, filename, path, status, timestamp, content_hash)
+                    SELECT id, filename, path, status, timestamp, content_hash FROM documents_old
+                """)
+                conn.execute("DROP TABLE documents_old")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_path ON documents (path)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_status ON documents (status, timestamp, id)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_timestamp ON documents (timestamp, id)
+            """)
+            # Every upload looks up its content hash and its filename's latest version.
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_content_hash ON documents (content_hash)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_documents_filename ON documents (filename, timestamp, id)
+            """)
+            # Filename search goes through an external-content FTS5 index kept in sync by triggers.
+            has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'documents_fts'").fetchone()
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts USING fts5(filename, content='documents', content_rowid='id')
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_fts_insert AFTER INSERT ON documents BEGIN
+                    INSERT INTO documents_fts (rowid, filename) VALUES (new.id, new.filename);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_fts_delete AFTER DELETE ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_fts_update AFTER UPDATE OF filename ON documents BEGIN
+                    INSERT INTO documents_fts (documents_fts, rowid, filename) VALUES ('delete', old.id, old.filename);
+                    INSERT INTO documents_fts (rowid, filename) VALUES (new.id, new.filename);
+                END
+            """)
+            if not has_fts:
+                conn.execute("INSERT INTO documents_fts (documents_fts) VALUES ('rebuild')")
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS ingest_jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    path TEXT NOT NULL,
+                    document_key TEXT,
+                    previous_path TEXT,
+                    status VARCHAR(20) NOT NULL
+                              CHECK(status IN ({", ".join(repr(status) for status in JOB_STATUSES)})),
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    error TEXT,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    batch_id INTEGER,
+                    chunks INTEGER
+                )
+            """)
+            job_columns = [row[1] for row in conn.execute("PRAGMA table_info(ingest_jobs)")]
+            for column in ("batch_id", "chunks"):
+                if column not in job_columns:
+                    conn.execute(f"ALTER TABLE ingest_jobs ADD COLUMN {column} INTEGER")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ingest_batches (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
             """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ingest_jobs_batch ON ingest_jobs (batch_id)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_ingest_jobs_status ON ingest_jobs (status, next_attempt_at)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS metadata (
+                    key TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                )
+            """)
+            conn.execute("""
+                INSERT OR IGNORE INTO metadata (key, value) VALUES ('corpus_version', 0)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS document_chunks (
+                    path TEXT NOT NULL,
+                    chunk_id TEXT NOT NULL,
+                    PRIMARY KEY (path, chunk_id)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_sessions (
+                    id TEXT PRIMARY KEY,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at)
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL REFERENCES chat_sessions (id),
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    citations TEXT,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chat_messages_session ON chat_messages (session_id, id)
+            """)
     
-    def add_document(self, filename, path, status="uploaded"):
-        with self.conn:
-            self.conn.execute("""
-                INSERT INTO documents (filename, path, status) VALUES (?, ?, ?)
-            """, (filename, path, status))
+    def add_document(self, filename, path, status="uploaded", content_hash=None):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO documents (filename, path, status, content_hash) VALUES (?, ?, ?, ?)
+            """, (filename, path, status, content_hash))
+
+    def find_document_by_hash(self, content_hash):
+        # Failed documents do not count as duplicates, so uploading the same file again retries it.
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT filename, status, timestamp, path FROM documents WHERE content_hash = ? AND status != 'failed' LIMIT 1
+            """, (content_hash,))
+            return cursor.fetchone()
+
+    def find_document_by_filename(self, filename):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT filename, status, timestamp, path FROM documents WHERE filename = ? ORDER BY timestamp DESC, id DESC LIMIT 1
+            """, (filename,))
+            return cursor.fetchone()
 
     def update_document_status(self, path, status):
-        with self.conn:
-            self.conn.execute("""
+        with self.pool.connection() as conn:
+            conn.execute("""
                 UPDATE documents SET status = ? WHERE path = ?
             """, (status, path))
     
-    def list_documents(self):
-        with self.conn:
-            cursor = self.conn.execute("""
-                SELECT filename, status, timestamp, path FROM documents ORDER BY timestamp DESC
+    def list_documents(self, cursor=None, limit=50, query=None, status=None):
+        """Returns one page of documents, newest first, and the cursor of the next page (None on the last page)."""
+        # Keyset pagination on (timestamp, id): each page is an index range scan regardless of its depth.
+        conditions, params = [], {"limit": limit + 1}
+        if status:
+            conditions.append("status = :status")
+            params["status"] = status
+        match = _match_expression(query)
+        if match:
+            conditions.append("id IN (SELECT rowid FROM documents_fts WHERE documents_fts MATCH :match)")
+            params["match"] = match
+        if cursor:
+            params["after_timestamp"], params["after_id"] = _decode_cursor(cursor)
+            conditions.append("(timestamp, id) < (:after_timestamp, :after_id)")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"""
+                SELECT filename, status, timestamp, path, id FROM documents {where}
+                ORDER BY timestamp DESC, id DESC LIMIT :limit
+            """, params).fetchall()
+        next_cursor = _encode_cursor(rows[limit - 1][2], rows[limit - 1][4]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
+        
+    def get_document(self, path):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT filename, status, timestamp, path, id FROM documents WHERE path = ?
+            """, (path,))
+            return cursor.fetchone()
+
+    def list_ingested_documents(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT filename, status, timestamp, path, id FROM documents WHERE status = 'ingested'
             """)
             return cursor.fetchall()
-        
+
     def delete_document(self, path):
-        with self.conn:
-            self.conn.execute("""
+        with self.pool.connection() as conn:
+            conn.execute("""
                 DELETE FROM documents WHERE path = ?
             """, (path,))
+            conn.execute("""
+                DELETE FROM ingest_jobs WHERE path = ?
+            """, (path,))
+            conn.execute("""
+                DELETE FROM document_chunks WHERE path = ?
+            """, (path,))
+
+    def list_document_paths(self):
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT path FROM documents")]
+
+    def set_document_chunks(self, path, chunk_ids):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM document_chunks WHERE path = ?", (path,))
+            conn.executemany("""
+                INSERT OR IGNORE INTO document_chunks (path, chunk_id) VALUES (?, ?)
+            """, [(path, chunk_id) for chunk_id in chunk_ids])
+
+    def list_document_chunks(self, path):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("SELECT chunk_id FROM document_chunks WHERE path = ?", (path,))
+            return [row[0] for row in cursor.fetchall()]
+
+    def delete_orphan_chunk_rows(self):
+        with self.pool.connection() as conn:
+            return conn.execute("""
+                DELETE FROM document_chunks WHERE path NOT IN (SELECT path FROM documents)
+            """).rowcount
+
+    def create_batch(self):
+        with self.pool.connection() as conn:
+            return conn.execute("INSERT INTO ingest_batches DEFAULT VALUES").lastrowid
+
+    def enqueue_job(self, path, document_key=None, previous_path=None, batch_id=None):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO ingest_jobs (path, document_key, previous_path, status, batch_id) VALUES (?, ?, ?, 'queued', ?)
+            """, (path, document_key, previous_path, batch_id))
+            conn.execute("""
+                UPDATE documents SET status = 'queued' WHERE path = ?
+            """, (path,))
+            return cursor.lastrowid
+
+    def claim_jobs(self, limit=1):
+        # A single UPDATE ... RETURNING keeps the claim atomic across worker processes. Jobs from the
+        # same bulk batch as the oldest ready job are claimed together so they convert and embed as one unit.
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                WITH first AS (
+                    SELECT id, batch_id FROM ingest_jobs
+                    WHERE status = 'queued' AND next_attempt_at <= :now
+                    ORDER BY id LIMIT 1
+                )
+                UPDATE ingest_jobs
+                SET status = 'converting', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id IN (
+                    SELECT id FROM ingest_jobs
+                    WHERE status = 'queued' AND next_attempt_at <= :now
+                      AND (id = (SELECT id FROM first) OR batch_id = (SELECT batch_id FROM first))
+                    ORDER BY id LIMIT :limit
+                )
+                RETURNING id, path, document_key, previous_path, attempts, batch_id
+            """, {"now": time.time(), "limit": limit})
+            rows = cursor.fetchall()
+            conn.executemany("""
+                UPDATE documents SET status = 'converting' WHERE path = ?
+            """, [(row[1],) for row in rows])
+        return [
+            dict(zip(("id", "path", "document_key", "previous_path", "attempts", "batch_id"), row))
+            for row in sorted(rows)
+        ]
+
+    def update_job_status(self, job_id, status, error=None, chunks=None):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                UPDATE ingest_jobs SET status = ?, error = ?, chunks = COALESCE(?, chunks), updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                RETURNING path
+            """, (status, error, chunks, job_id))
+            row = cursor.fetchone()
+            if row is not None:
+                conn.execute("""
+                    UPDATE documents SET status = ? WHERE path = ?
+                """, (status, row[0]))
+
+    def retry_job(self, job_id, error, delay_seconds):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                UPDATE ingest_jobs
+                SET status = 'queued', error = ?, next_attempt_at = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE id = ?
+                RETURNING path
+            """, (error, time.time() + delay_seconds, job_id))
+            row = cursor.fetchone()
+            if row is not None:
+                conn.execute("""
+                    UPDATE documents SET status = 'queued' WHERE path = ?
+                """, (row[0],))
+
+    def requeue_interrupted_jobs(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                UPDATE ingest_jobs SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE status IN ('converting', 'embedding')
+                RETURNING path
+            """)
+            paths = [row[0] for row in cursor.fetchall()]
+            conn.executemany("""
+                UPDATE documents SET status = 'queued' WHERE path = ?
+            """, [(path,) for path in paths])
+            return len(paths)
+
+    def list_unqueued_documents(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT filename, path FROM documents
+                WHERE status = 'uploaded' AND path NOT IN (SELECT path FROM ingest_jobs)
+            """)
+            return cursor.fetchall()
+
+    def get_job(self, job_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT id, path, status, attempts, error, created_at, updated_at FROM ingest_jobs WHERE id = ?
+            """, (job_id,))
+            row = cursor.fetchone()
+            if row is None:
+                return None
+            return dict(zip(("id", "path", "status", "attempts", "error", "created_at", "updated_at"), row))
+
+    def list_jobs(self, status=None, limit=100):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT id, path, status, attempts, error, created_at, updated_at FROM ingest_jobs
+                WHERE (? IS NULL OR status = ?)
+                ORDER BY id DESC LIMIT ?
+            """, (status, status, limit))
+            return [
+                dict(zip(("id", "path", "status", "attempts", "error", "created_at", "updated_at"), row))
+                for row in cursor.fetchall()
+            ]
+
+    def get_batch_progress(self, batch_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT status, COUNT(*), COALESCE(SUM(chunks), 0) FROM ingest_jobs WHERE batch_id = ? GROUP BY status
+            """, (batch_id,))
+            rows = cursor.fetchall()
+            if not rows:
+                return None
+            progress = {"batch_id": batch_id, "total": sum(row[1] for row in rows), "chunks": sum(row[2] for row in rows)}
+            progress.update({status: 0 for status in JOB_STATUSES})
+            progress.update({row[0]: row[1] for row in rows})
+            return progress
+
+    def queue_depth(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT COUNT(*) FROM ingest_jobs WHERE status IN ('queued', 'converting', 'embedding')
+            """)
+            return cursor.fetchone()[0]
     
+    def get_corpus_version(self):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT value FROM metadata WHERE key = 'corpus_version'
+            """)
+            return cursor.fetchone()[0]
+
+    def get_metadata_value(self, key, default=0):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM metadata WHERE key = ?", (key,)).fetchone()
+            return row[0] if row else default
+
+    def set_metadata_value(self, key, value):
+        with self.pool.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES (?, ?)", (key, value))
+
+    def bump_corpus_version(self):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                UPDATE metadata SET value = value + 1 WHERE key = 'corpus_version'
+            """)
+
+    def create_session(self):
+        session_id = uuid.uuid4().hex
+        with self.pool.connection() as conn:
+            conn.execute("""
+                INSERT INTO chat_sessions (id, updated_at) VALUES (?, ?)
+            """, (session_id, time.time()))
+        return session_id
+
+    def session_exists(self, session_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT 1 FROM chat_sessions WHERE id = ?
+            """, (session_id,))
+            return cursor.fetchone() is not None
+
+    def add_messages(self, session_id, messages):
+        """Appends (role, content, citations) messages to a session and marks it as recently used."""
+        with self.pool.connection() as conn:
+            conn.executemany("""
+                INSERT INTO chat_messages (session_id, role, content, citations) VALUES (?, ?, ?, ?)
+            """, [(session_id, role, content, json.dumps(citations) if citations else None) for role, content, citations in messages])
+            conn.execute("""
+                UPDATE chat_sessions SET updated_at = ? WHERE id = ?
+            """, (time.time(), session_id))
+
+    def list_messages(self, session_id):
+        with self.pool.connection() as conn:
+            cursor = conn.execute("""
+                SELECT role, content, citations, created_at FROM chat_messages WHERE session_id = ? ORDER BY id
+            """, (session_id,))
+            return [
+                {"role": role, "content": content, "citations": json.loads(citations) if citations else [], "created_at": created_at}
+                for role, content, citations, created_at in cursor.fetchall()
+            ]
+
+    def list_recent_messages(self, session_id, skip: int = 0, max_chars: int = None):
+        """Returns the (role, content) messages after the first skip of a session, oldest first, and the
+        session's message count. With max_chars, reading stops at the newest messages that fill it."""
+        with self.pool.connection() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM chat_messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+            cursor = conn.execute("""
+                SELECT role, content FROM chat_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?
+            """, (session_id, max(total - skip, 0)))
+            messages, chars = [], 0
+            for role, content in cursor:
+                messages.append({"role": role, "content": content})
+                chars += len(role) + len(content) + 3
+                if max_chars is not None and chars >= max_chars:
+                    break
+        messages.reverse()
+        return messages, total
+
+    def delete_session(self, session_id):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM chat_messages WHERE session_id = ?", (session_id,))
+            return conn.execute("DELETE FROM chat_sessions WHERE id = ?", (session_id,)).rowcount > 0
+
+    def purge_expired_sessions(self, max_age_seconds):
+        with self.pool.connection() as conn:
+            cutoff = time.time() - max_age_seconds
+            conn.execute("""
+                DELETE FROM chat_messages WHERE session_id IN (SELECT id FROM chat_sessions WHERE updated_at < ?)
+            """, (cutoff,))
+            return conn.execute("DELETE FROM chat_sessions WHERE updated_at < ?", (cutoff,)).rowcount
+
     def disconnect(self):
-        self.conn.close()
+        self.pool.close()
     
 
 if __name__ == "__main__":
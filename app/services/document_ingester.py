@@ -1,71 +1,257 @@
-from langchain_chroma.vectorstores import Chroma
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_core.documents import Document
 from docling.chunking import HybridChunker
 from docling.document_converter import DocumentConverter
+from docling.datamodel.base_models import ConversionStatus
 from pathlib import Path
+from app.services.embeddings import CachedEmbeddings
+from app.services.storage import get_max_batch_size, get_vector_collection, reset_vector_collection
+from app.services.lexical_index import LexicalIndex
+from app.services.tokens import estimate_tokens
+from app.services.metrics import span, timed_iter
 from dotenv import load_dotenv
+import hashlib
 import os
 import logging
 
 class Ingester:
-    def __init__(self, embedding_model:HuggingFaceEmbeddings=None):
-        self.embedding_model= embedding_model if embedding_model else HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+    def __init__(self, embedding_model:Embeddings=None, connect_vector_store:bool=True):
+        self.embedding_model= embedding_model if embedding_model else CachedEmbeddings()
         load_dotenv()
         self.DATA_DIR = os.getenv("DATA_DIR")
-        self.vector_store= Chroma(
-            collection_name="documents_collection",
-            embedding_function=self.embedding_model,
-            persist_directory=os.path.join(self.DATA_DIR,"chroma_db")
-        )
+        # Ingest worker processes only convert and embed; the vector store is written by a single process.
+        if connect_vector_store:
+            get_vector_collection(self.embedding_model)
+        self.lexical_index= LexicalIndex() if connect_vector_store else None
 
         self.converter= DocumentConverter()
         self.chunker= HybridChunker(max_tokens=400, overlap=50)
+        self.embed_batch_size = int(os.getenv("EMBED_BATCH_SIZE", "256"))
         self.logger = logging.getLogger(__name__)
 
-    def ingest_documents(self,documents_path):
-        source_path = Path(documents_path)
-        converted=self.converter.convert(source=source_path).document
-        chunks= self.chunker.chunk(dl_doc=converted)
-        lc_docs= [Document(page_content=chunk.text,metadata={"source": str(source_path.resolve())}) for chunk in chunks]
-        self.logger.info(f"Ingesting {len(lc_docs)} chunks from document '{source_path}' into the vector store.")
-        self.vector_store.add_documents(documents=lc_docs)
+    @property
+    def collection(self):
+        return get_vector_collection(self.embedding_model)
+
+    @staticmethod
+    def chunk_id(document_key: str, content_hash: str):
+        return hashlib.sha256(f"{document_key}\0{content_hash}".encode("utf-8")).hexdigest()
+
+    def _chunk_document(self, converted, source: str, document_key: str):
+        # Chunk IDs are derived from the document key and chunk text, so repeated paragraphs collapse
+        # into one vector and unchanged chunks keep their ID across re-uploads of the same file.
+        lc_docs = {}
+        for chunk in timed_iter(self.chunker.chunk(dl_doc=converted), "chunk"):
+            content_hash = hashlib.sha256(chunk.text.encode("utf-8")).hexdigest()
+            chunk_id = self.chunk_id(document_key, content_hash)
+            if chunk_id not in lc_docs:
+                lc_docs[chunk_id] = Document(page_content=chunk.text, metadata=self._chunk_metadata(chunk, source, content_hash, len(lc_docs)))
+        return lc_docs
+
+    @staticmethod
+    def _chunk_metadata(chunk, source: str, content_hash: str, ordinal: int):
+        # Chroma metadata values must be scalars, so pages become a range and headings a joined path.
+        metadata = {
+            "source": source,
+            "filename": os.path.basename(source),
+            "content_hash": content_hash,
+            "chunk_index": ordinal,
+            "token_count": estimate_tokens(chunk.text),
+        }
+        pages = sorted({prov.page_no for item in chunk.meta.doc_items for prov in item.prov})
+        if pages:
+            metadata["page_start"], metadata["page_end"] = pages[0], pages[-1]
+        if chunk.meta.headings:
+            metadata["headings"] = " > ".join(chunk.meta.headings)
+        return metadata
+
+    def _embed(self, texts: list[str]):
+        embeddings = []
+        for start in range(0, len(texts), self.embed_batch_size):
+            with span("embed"):
+                embeddings.extend(self.embedding_model.embed_documents(texts[start:start + self.embed_batch_size]))
+        return embeddings
+
+    def prepare_many(self, documents: list[tuple], on_stage=None):
+        """Converts, chunks and embeds (path, document_key) pairs; failed documents carry an "error" instead of chunks."""
+        sources = {str(Path(path).resolve()): (str(path), document_key) for path, document_key in documents}
+        converted = {}
+        # convert_all is lazy, so conversion time is measured per result and chunking separately.
+        for result in timed_iter(self.converter.convert_all([Path(path) for path, _ in documents], raises_on_error=False), "convert"):
+            source = str(Path(result.input.file).resolve())
+            if result.status in (ConversionStatus.SUCCESS, ConversionStatus.PARTIAL_SUCCESS):
+                converted[source] = self._chunk_document(result.document, source, sources[source][1] or source)
+            else:
+                converted[source] = RuntimeError(f"Conversion failed with status {result.status}: {result.errors}")
+
+        if on_stage:
+            on_stage("embedding")
+        # Embed the chunks of every document together in fixed-size batches.
+        texts = [doc.page_content for lc_docs in converted.values() if isinstance(lc_docs, dict) for doc in lc_docs.values()]
+        embeddings = iter(self._embed(texts))
+
+        prepared = []
+        for source, (path, _) in sources.items():
+            lc_docs = converted.get(source, RuntimeError("Document was not converted."))
+            if isinstance(lc_docs, Exception):
+                prepared.append({"path": path, "error": lc_docs})
+                continue
+            prepared.append({
+                "path": path,
+                "ids": list(lc_docs),
+                "texts": [doc.page_content for doc in lc_docs.values()],
+                "metadatas": [doc.metadata for doc in lc_docs.values()],
+                "embeddings": [next(embeddings) for _ in lc_docs],
+            })
+        return prepared
+
+    def prepare_documents(self, documents_path, document_key:str=None, on_stage=None):
+        prepared = self.prepare_many([(documents_path, document_key)], on_stage=on_stage)[0]
+        if "error" in prepared:
+            raise prepared["error"]
+        return prepared
+
+    def write_many(self, documents: list[tuple]):
+        """Writes (prepared, previous_path[, document_metadata]) tuples with one bulk delete, update and add against the vector store.
+
+        document_metadata (e.g. the document's database id and upload time) is merged into every chunk's metadata.
+        """
+        stale_ids, kept, new, summaries = [], [], [], []
+        new_ids = set()
+        for prepared, previous_path, *rest in documents:
+            if rest and rest[0]:
+                prepared = {**prepared, "metadatas": [{**metadata, **rest[0]} for metadata in prepared["metadatas"]]}
+            ids = prepared["ids"]
+            existing_ids = set()
+            if previous_path:
+                previous_source = str(Path(previous_path).resolve())
+                existing_ids = set(self.collection.get(where={"source": previous_source}, include=[])["ids"])
+            doc_new = [i for i, chunk_id in enumerate(ids) if chunk_id not in existing_ids and chunk_id not in new_ids]
+            doc_kept = [i for i, chunk_id in enumerate(ids) if chunk_id in existing_ids]
+            doc_stale = list(existing_ids - set(ids))
+            stale_ids += doc_stale
+            kept += [(prepared, i) for i in doc_kept]
+            new += [(prepared, i) for i in doc_new]
+            new_ids.update(ids[i] for i in doc_new)
+            self.logger.info(
+                f"Ingesting {len(ids)} chunks from document '{prepared['path']}' into the vector store "
+                f"({len(doc_new)} new, {len(doc_kept)} unchanged, {len(doc_stale)} stale)."
+            )
+            summaries.append({"chunks": len(ids), "added": len(doc_new), "unchanged": len(doc_kept), "deleted": len(doc_stale)})
+
+        collection = self.collection
+        max_batch = get_max_batch_size(self.embedding_model)
+        with span("vector_write"):
+            for start in range(0, len(stale_ids), max_batch):
+                collection.delete(ids=stale_ids[start:start + max_batch])
+            for start in range(0, len(kept), max_batch):
+                batch = kept[start:start + max_batch]
+                collection.update(
+                    ids=[prepared["ids"][i] for prepared, i in batch],
+                    metadatas=[prepared["metadatas"][i] for prepared, i in batch]
+                )
+            for start in range(0, len(new), max_batch):
+                batch = new[start:start + max_batch]
+                collection.add(
+                    ids=[prepared["ids"][i] for prepared, i in batch],
+                    embeddings=[prepared["embeddings"][i] for prepared, i in batch],
+                    documents=[prepared["texts"][i] for prepared, i in batch],
+                    metadatas=[prepared["metadatas"][i] for prepared, i in batch]
+                )
+
+        with span("lexical_write"):
+            self.lexical_index.delete(stale_ids)
+            self.lexical_index.update([prepared["ids"][i] for prepared, i in kept], [prepared["metadatas"][i] for prepared, i in kept])
+            self.lexical_index.add(
+                [prepared["ids"][i] for prepared, i in new],
+                [prepared["texts"][i] for prepared, i in new],
+                [prepared["metadatas"][i] for prepared, i in new]
+            )
+        return summaries
+
+    def sync_lexical_index(self, page_size: int = 1000):
+        """Backfills the lexical index from the vector store when it is empty, e.g. for collections ingested before it existed."""
+        collection = self.collection
+        if self.lexical_index.count() or not collection.count():
+            return 0
+        synced = 0
+        for page in self.iter_chunks(page_size, include=["documents", "metadatas"]):
+            self.lexical_index.add(page["ids"], page["documents"], [metadata or {} for metadata in page["metadatas"]])
+            synced += len(page["ids"])
+        self.logger.info(f"Backfilled the lexical index with {synced} chunks from the vector store.")
+        return synced
+
+    def write_documents(self, prepared: dict, previous_path:str=None, document_metadata:dict=None):
+        return self.write_many([(prepared, previous_path, document_metadata)])[0]
+
+    def ingest_documents(self,documents_path, document_key:str=None, previous_path:str=None, document_metadata:dict=None):
+        prepared = self.prepare_documents(documents_path, document_key=document_key)
+        return self.write_documents(prepared, previous_path=previous_path, document_metadata=document_metadata)
+
+    def backfill_document_metadata(self, documents: list[tuple]):
+        """Stamps (path, document_metadata) onto the existing chunks of each document, for chunks ingested before it was recorded."""
+        collection = self.collection
+        updated = 0
+        for path, document_metadata in documents:
+            chunks = collection.get(where={"source": str(Path(path).resolve())}, include=["metadatas"])
+            if not chunks["ids"]:
+                continue
+            metadatas = [{**(metadata or {}), "filename": os.path.basename(path), **document_metadata} for metadata in chunks["metadatas"]]
+            collection.update(ids=chunks["ids"], metadatas=metadatas)
+            self.lexical_index.update(chunks["ids"], metadatas)
+            updated += len(chunks["ids"])
+        self.logger.info(f"Backfilled document metadata on {updated} chunks.")
+        return updated
     
-    def delete_document(self,source: str):
+    def delete_chunks(self, chunk_ids: list[str]):
+        collection = self.collection
+        max_batch = get_max_batch_size(self.embedding_model)
+        for start in range(0, len(chunk_ids), max_batch):
+            collection.delete(ids=chunk_ids[start:start + max_batch])
+        self.lexical_index.delete(chunk_ids)
+        return len(chunk_ids)
+
+    def delete_document(self,source: str, chunk_ids: list[str]=None):
+        """Deletes a document's vectors and lexical entries, then its file.
+
+        chunk_ids recorded at ingest make this a direct id delete; documents ingested before ids were recorded
+        fall back to a single metadata delete on the resolved source path. Vector errors propagate before the
+        file is touched, so a failed delete can simply be retried.
+        """
         source_path = Path(source)
+        abs_source = str(source_path.resolve())
+        if chunk_ids:
+            self.delete_chunks(chunk_ids)
+        else:
+            self.collection.delete(where={"source": abs_source})
+        self.lexical_index.delete_source(abs_source)
+
         try:
             os.remove(source_path)
         except FileNotFoundError:
             self.logger.warning(f"File {source_path} not found for deletion.")
-            pass  # If the file does not exist, we can ignore the error
-        # Attempt to delete by the given source value and also by the resolved absolute path.
-        deleted_any = False
-        try:
-            self.vector_store.delete(where={"source": source})
-            deleted_any = True
-        except Exception as e:
-            self.logger.debug(f"Vector delete by provided source failed: {e}")
-
-        try:
-            abs_source = str(source_path.resolve())
-            # If abs_source equals the original, this will just repeat; that's fine.
-            self.vector_store.delete(where={"source": abs_source})
-            deleted_any = True
-        except Exception as e:
-            self.logger.debug(f"Vector delete by absolute source failed: {e}")
-
-        if not deleted_any:
-            self.logger.warning(f"No vector entries deleted for source '{source}' or '{abs_source}'.")
 
-        return f"Documents from source '{source}' have been cleared from the vector store. deleted={deleted_any}"
+        return f"Documents from source '{source}' have been cleared from the vector store. chunks={len(chunk_ids) if chunk_ids else 'by source'}"
     
+    def compact_vectors(self):
+        # Only the quantized backend keeps tombstoned rows on disk; Chroma reclaims deleted vectors itself.
+        compact = getattr(self.collection, "compact", None)
+        return compact() if compact else 0
+
     def clear_document(self):
-        return self.vector_store.reset_collection()
+        self.lexical_index.clear()
+        return reset_vector_collection(self.embedding_model)
     
-    def list_chunks(self):
-        return self.vector_store.get(limit=100000,offset=0)
+    def iter_chunks(self, page_size: int = 1000, include: list[str] = None):
+        """Yields the collection page by page, so audits never hold more than one page of chunks in memory."""
+        collection = self.collection
+        offset = 0
+        while True:
+            page = collection.get(limit=page_size, offset=offset, include=include if include is not None else ["metadatas"])
+            if not page["ids"]:
+                return
+            yield page
+            offset += len(page["ids"])
         
 
 if __name__ == "__main__":
@@ -76,4 +262,5 @@ if __name__ == "__main__":
     print("Deleted document and its chunks from the vector store.")
     ingester.clear_document()
     print("Cleared documents from the vector store.")
-    print(ingester.list_chunks())
\ No newline at end of file
+    for page in ingester.iter_chunks():
+        print(page["ids"])
\ No newline at end of file
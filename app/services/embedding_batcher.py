@@ -0,0 +1,159 @@
+from langchain_core.embeddings import Embeddings
+from app.services.metrics import EMBED_BATCH_SIZE, EMBED_QUEUE_WAIT, span
+from concurrent.futures import Future
+from collections import deque
+from dotenv import load_dotenv
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+class _Request:
+    __slots__ = ("kind", "texts", "future", "enqueued_at")
+
+    def __init__(self, kind: str, texts: list[str]):
+        self.kind = kind
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+class EmbeddingBatcher:
+    """Groups embedding calls from concurrent callers into micro-batches run as one forward pass.
+
+    A batch is flushed when it holds max_batch_size texts or max_wait_ms after its oldest request arrived.
+    Interactive requests are always taken before bulk ones, and bulk requests are split into slices of
+    max_batch_size, so a chat query waits for at most one ingest slice that is already running.
+    """
+
+    def __init__(self, embedding_model: Embeddings, max_batch_size: int = None, max_wait_ms: float = None):
+        load_dotenv()
+        self.embedding_model = embedding_model
+        self.model_name = getattr(embedding_model, "model_name", None)
+        self.max_batch_size = max_batch_size or int(os.getenv("EMBED_MICROBATCH_MAX_SIZE", "32"))
+        self.max_wait = (max_wait_ms if max_wait_ms is not None else float(os.getenv("EMBED_MICROBATCH_MAX_WAIT_MS", "5"))) / 1000
+        self.queues = {INTERACTIVE: deque(), BULK: deque()}
+        self.condition = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self._run, name="embedding-batcher", daemon=True)
+        self.thread.start()
+
+    def client(self, priority: int = INTERACTIVE):
+        return BatchedEmbeddings(self, priority)
+
+    def submit(self, kind: str, texts: list[str], priority: int = INTERACTIVE):
+        """Queues texts for embedding and returns one future per slice of at most max_batch_size texts."""
+        requests = [_Request(kind, texts[start:start + self.max_batch_size]) for start in range(0, len(texts), self.max_batch_size)]
+        with self.condition:
+            if self.stopped:
+                raise RuntimeError("The embedding batcher has been stopped.")
+            self.queues[priority].extend(requests)
+            self.condition.notify()
+        return [request.future for request in requests]
+
+    def stop(self):
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join(timeout=5)
+
+    def _pending(self):
+        return sum(len(request.texts) for queue in self.queues.values() for request in queue)
+
+    def _head(self):
+        for priority in (INTERACTIVE, BULK):
+            if self.queues[priority]:
+                return priority, self.queues[priority][0]
+        return None, None
+
+    def _take_batch(self):
+        # The oldest request of the highest priority sets the kind; later requests of the same kind join it.
+        _, head = self._head()
+        batch, size = [], 0
+        for priority in (INTERACTIVE, BULK):
+            queue = self.queues[priority]
+            for request in list(queue):
+                if request.kind != head.kind or (batch and size + len(request.texts) > self.max_batch_size):
+                    continue
+                queue.remove(request)
+                batch.append((priority, request))
+                size += len(request.texts)
+                if size >= self.max_batch_size:
+                    return batch
+        return batch
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.stopped and self._head()[1] is None:
+                    self.condition.wait()
+                if self.stopped:
+                    break
+                # Hold the batch open until it is full or its oldest request has waited max_wait.
+                deadline = self._head()[1].enqueued_at + self.max_wait
+                while not self.stopped and self._pending() < self.max_batch_size:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self._take_batch()
+            self._embed(batch)
+        with self.condition:
+            pending = [request for queue in self.queues.values() for request in queue]
+            for queue in self.queues.values():
+                queue.clear()
+        for request in pending:
+            request.future.set_exception(RuntimeError("The embedding batcher has been stopped."))
+
+    def _embed(self, batch: list[tuple]):
+        started = time.perf_counter()
+        kind = batch[0][1].kind
+        texts = [text for _, request in batch for text in request.texts]
+        for priority, request in batch:
+            EMBED_QUEUE_WAIT.labels(PRIORITY_NAMES[priority]).observe(started - request.enqueued_at)
+        EMBED_BATCH_SIZE.labels(kind).observe(len(texts))
+        try:
+            with span("embedding_batch"):
+                if kind == "query" and self._query_specific():
+                    vectors = [self.embedding_model.embed_query(text) for text in texts]
+                else:
+                    vectors = self.embedding_model.embed_documents(texts)
+        except Exception as e:
+            logger.error(f"Embedding batch of {len(texts)} texts failed: {e}", exc_info=True)
+            for _, request in batch:
+                request.future.set_exception(e)
+            return
+        offset = 0
+        for _, request in batch:
+            request.future.set_result(vectors[offset:offset + len(request.texts)])
+            offset += len(request.texts)
+
+    def _query_specific(self):
+        # HuggingFaceEmbeddings encodes queries differently only when query_encode_kwargs are set.
+        return bool(getattr(self.embedding_model, "query_encode_kwargs", None))
+
+class BatchedEmbeddings(Embeddings):
+    """An Embeddings view of an EmbeddingBatcher that submits every call at a fixed priority."""
+
+    def __init__(self, batcher: EmbeddingBatcher, priority: int = INTERACTIVE):
+        self.batcher = batcher
+        self.priority = priority
+        if batcher.model_name:
+            # CachedEmbeddings keys its cache by model name, so cached vectors survive turning batching on.
+            self.model_name = batcher.model_name
+
+    def _wait(self, futures: list[Future]):
+        return [vector for future in futures for vector in future.result()]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        return self._wait(self.batcher.submit("document", list(texts), self.priority))
+
+    def embed_query(self, text: str) -> list[float]:
+        return self._wait(self.batcher.submit("query", [text], self.priority))[0]
@@ -0,0 +1,90 @@
+from langchain_core.embeddings import Embeddings
+from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from app.services.storage import get_sqlite_pool
+from dotenv import load_dotenv
+import numpy as np
+import torch
+import hashlib
+import os
+
+DEFAULT_MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+def cpu_share(processes: int):
+    return max((os.cpu_count() or 1) // max(processes, 1), 1)
+
+def configure_torch_threads(threads: int = None):
+    """Caps this process's intra-op threads for MiniLM and the reranker at threads, else EMBED_THREADS, else an
+    even share of the cores across the WEB_CONCURRENCY API workers, so N workers do not oversubscribe the CPU."""
+    load_dotenv()
+    if threads is None:
+        threads = int(os.getenv("EMBED_THREADS") or cpu_share(int(os.getenv("WEB_CONCURRENCY", "1"))))
+    torch.set_num_threads(threads)
+    return threads
+
+class CachedEmbeddings(Embeddings):
+    """Wraps an embedding model with an on-disk cache keyed by (model name, sha256 of the text)."""
+
+    def __init__(self, embedding_model:Embeddings=None, model_name:str=DEFAULT_MODEL_NAME):
+        load_dotenv()
+        self.embedding_model = embedding_model if embedding_model else HuggingFaceEmbeddings(model_name=model_name)
+        self.model_name = getattr(self.embedding_model, "model_name", model_name)
+        self.db_path = os.path.join(os.getenv("DATA_DIR"), "embedding_cache/embeddings.db")
+        self.pool = get_sqlite_pool(self.db_path)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    model TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (model, hash)
+                ) WITHOUT ROWID
+            """)
+
+    @staticmethod
+    def _hash(text: str):
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _lookup(self, model: str, hashes: list[str], batch_size: int = 500):
+        found = {}
+        with self.pool.connection() as conn:
+            for start in range(0, len(hashes), batch_size):
+                batch = hashes[start:start + batch_size]
+                cursor = conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({','.join('?' * len(batch))})",
+                    (model, *batch)
+                )
+                for text_hash, blob in cursor:
+                    found[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return found
+
+    def _store(self, model: str, items: dict):
+        with self.pool.connection() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, hash, vector) VALUES (?, ?, ?)",
+                [(model, text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in items.items()]
+            )
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        hashes = [self._hash(text) for text in texts]
+        unique = dict(zip(hashes, texts))
+        vectors = self._lookup(self.model_name, list(unique))
+        missing = [text_hash for text_hash in unique if text_hash not in vectors]
+        if missing:
+            computed = self.embedding_model.embed_documents([unique[text_hash] for text_hash in missing])
+            new_vectors = dict(zip(missing, computed))
+            self._store(self.model_name, new_vectors)
+            vectors.update(new_vectors)
+        return [vectors[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> list[float]:
+        # Query embeddings may differ from document embeddings for some models, so cache them separately.
+        model = f"{self.model_name}:query"
+        text_hash = self._hash(text)
+        vector = self._lookup(model, [text_hash]).get(text_hash)
+        if vector is None:
+            vector = self.embedding_model.embed_query(text)
+            self._store(model, {text_hash: vector})
+        return vector
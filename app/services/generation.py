@@ -1,6 +1,7 @@
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from app.services.metrics import span
 from dotenv import load_dotenv
 import os
 
@@ -14,19 +15,31 @@ class Generation:
             google_api_key=self.google_api_key
         )
 
-    def generate_response(self, prompt: str, content:str, history:str) -> str:
         template="""Answer the following question based on this context:
 {context}
 Question: {question}
 History: {history}
 """
         prompt_template = ChatPromptTemplate.from_template(template)
-        chain = (prompt_template
+        self.chain = (prompt_template
                  | self.llm
                  | StrOutputParser()
         )
-        response = chain.invoke({"context": content, "question": prompt, "history": history})
+
+    def generate_response(self, prompt: str, content:str, history:str) -> str:
+        with span("generation"):
+            response = self.chain.invoke({"context": content, "question": prompt, "history": history})
         return response
+
+    async def agenerate_response(self, prompt: str, content: str, history: str) -> str:
+        with span("generation"):
+            response = await self.chain.ainvoke({"context": content, "question": prompt, "history": history})
+        return response
+
+    async def astream_response(self, prompt: str, content: str, history: str):
+        with span("generation"):
+            async for token in self.chain.astream({"context": content, "question": prompt, "history": history}):
+                yield token
     
 
 if __name__ == "__main__":
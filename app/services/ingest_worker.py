@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+from app.services.database import Database, document_metadata
+from app.services.document_ingester import Ingester
+from app.services.embeddings import configure_torch_threads, cpu_share
+from app.services.metrics import CHUNKS_INGESTED, DOCUMENTS_INGESTED, collect_timings, observe_timings
+from dotenv import load_dotenv
+import multiprocessing
+import threading
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+# --- Worker process state ---
+_worker_ingester = None
+_worker_database = None
+
+def _init_worker(embed_threads: int):
+    global _worker_ingester, _worker_database
+    configure_torch_threads(embed_threads)
+    _worker_ingester = Ingester(connect_vector_store=False)
+    _worker_database = Database()
+
+def _prepare_timed(ingester: Ingester, database: Database, jobs: list[dict]):
+    # Stage timings travel back with the result; metrics recorded inside a worker process would never be scraped.
+    with collect_timings(observe=False) as timings:
+        prepared = ingester.prepare_many(
+            [(job["path"], job["document_key"]) for job in jobs],
+            on_stage=lambda stage: [database.update_job_status(job["id"], stage) for job in jobs]
+        )
+    return prepared, timings
+
+def _prepare_jobs(jobs: list[dict]):
+    return _prepare_timed(_worker_ingester, _worker_database, jobs)
+
+class IngestWorkerPool:
+    """Claims jobs from the SQLite ingest queue and converts/embeds them in a pool of worker processes.
+
+    Vector store writes stay in this process, so Chroma only ever has a single writer.
+    """
+
+    def __init__(self, ingester: Ingester, on_ingested=None):
+        load_dotenv()
+        self.ingester = ingester
+        self.on_ingested = on_ingested
+        self.database = Database()
+        self.num_workers = int(os.getenv("INGEST_WORKERS", "2"))
+        self.max_attempts = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+        self.backoff_seconds = float(os.getenv("INGEST_RETRY_BACKOFF_SECONDS", "5"))
+        self.poll_interval = float(os.getenv("INGEST_POLL_INTERVAL_SECONDS", "1"))
+        self.batch_size = int(os.getenv("INGEST_BATCH_SIZE", "16"))
+        # Each worker process loads its own MiniLM; by default the workers and the API process split the cores.
+        self.embed_threads = int(os.getenv("INGEST_EMBED_THREADS") or cpu_share(self.num_workers + 1))
+        self.executor = None
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def _create_executor(self):
+        # INGEST_WORKERS=0 runs ingestion on a single thread inside the API process instead.
+        if self.num_workers > 0:
+            return ProcessPoolExecutor(
+                max_workers=self.num_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(self.embed_threads,)
+            )
+        return ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+
+    def _submit(self, jobs: list[dict]):
+        if self.num_workers > 0:
+            return self.executor.submit(_prepare_jobs, jobs)
+        return self.executor.submit(_prepare_timed, self.ingester, self.database, jobs)
+
+    def start(self):
+        self.executor = self._create_executor()
+        self.thread = threading.Thread(target=self._run, name="ingest-dispatcher", daemon=True)
+        self.thread.start()
+        logger.info(f"Ingest worker pool started with {self.num_workers} worker processes.", extra={"extra": {"embed_threads": self.embed_threads}})
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.executor:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        # The SQLite pool is shared with the API process's Database; the app closes it once at shutdown.
+
+    def _run(self):
+        in_flight = {}
+        capacity = max(self.num_workers, 1)
+        while not self.stop_event.is_set():
+            while len(in_flight) < capacity:
+                jobs = self.database.claim_jobs(self.batch_size)
+                if not jobs:
+                    break
+                for job in jobs:
+                    logger.info(f"Starting document ingestion for {job['path']}", extra={"extra": {"job_id": job["id"], "batch_id": job["batch_id"], "document_path": job["path"], "attempt": job["attempts"]}})
+                in_flight[self._submit(jobs)] = jobs
+
+            if not in_flight:
+                self.stop_event.wait(self.poll_interval)
+                continue
+
+            done, _ = wait(in_flight, timeout=self.poll_interval, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                jobs = in_flight.pop(future)
+                try:
+                    self._complete(jobs, future.result())
+                except BrokenProcessPool as e:
+                    broken = True
+                    for job in jobs:
+                        self._fail(job, e)
+                except Exception as e:
+                    for job in jobs:
+                        self._fail(job, e)
+
+            if broken:
+                # A worker died (e.g. OOM during conversion); every in-flight job is lost with the pool.
+                for jobs in in_flight.values():
+                    for job in jobs:
+                        self._fail(job, RuntimeError("Ingest worker process terminated unexpectedly."))
+                in_flight.clear()
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                self.executor = self._create_executor()
+
+    def _complete(self, jobs: list[dict], result: tuple):
+        prepared_list, stages = result
+        observe_timings(stages)
+        to_write = []
+        for job, prepared in zip(jobs, prepared_list):
+            document = None if "error" in prepared else self.database.get_document(job["path"])
+            if "error" in prepared:
+                self._fail(job, prepared["error"])
+            elif document is None:
+                logger.info(f"Document {job['path']} was deleted during ingestion; discarding chunks.", extra={"extra": {"job_id": job["id"]}})
+            else:
+                to_write.append((job, prepared, document_metadata(document)))
+        if not to_write:
+            return
+
+        with collect_timings() as write_stages:
+            summaries = self.ingester.write_many([(prepared, job["previous_path"], metadata) for job, prepared, metadata in to_write])
+        logger.info("Ingest batch written", extra={"extra": {"jobs": len(jobs), "written": len(to_write), "stages_ms": {**stages, **write_stages}}})
+        for (job, prepared, _), summary in zip(to_write, summaries):
+            self.database.set_document_chunks(job["path"], prepared["ids"])
+            self.database.update_job_status(job["id"], "ingested", chunks=summary["chunks"])
+            DOCUMENTS_INGESTED.labels("ingested").inc()
+            CHUNKS_INGESTED.labels("added").inc(summary["added"])
+            CHUNKS_INGESTED.labels("unchanged").inc(summary["unchanged"])
+            logger.info(f"Document ingestion completed for {job['path']}", extra={"extra": {"job_id": job["id"], "batch_id": job["batch_id"], "document_path": job["path"], **summary}})
+            if self.on_ingested:
+                self.on_ingested(job, summary)
+
+    def _fail(self, job: dict, error: Exception):
+        if job["attempts"] >= self.max_attempts:
+            self.database.update_job_status(job["id"], "failed", error=str(error))
+            DOCUMENTS_INGESTED.labels("failed").inc()
+            logger.error(f"Document ingestion failed for {job['path']}: {error}", extra={"extra": {"job_id": job["id"], "attempts": job["attempts"]}})
+            return
+        delay = self.backoff_seconds * 2 ** (job["attempts"] - 1)
+        self.database.retry_job(job["id"], str(error), delay)
+        logger.warning(f"Document ingestion failed for {job['path']}, retrying in {delay}s: {error}", extra={"extra": {"job_id": job["id"], "attempts": job["attempts"]}})
@@ -0,0 +1,127 @@
+from app.services.storage import get_sqlite_pool
+from dotenv import load_dotenv
+import json
+import re
+import os
+
+class LexicalIndex:
+    """BM25 index over chunk text in SQLite FTS5, kept alongside the Chroma collection under the same chunk ids."""
+
+    def __init__(self):
+        load_dotenv()
+        self.db_path = os.path.join(os.getenv("DATA_DIR"), "lexical_index/chunks.db")
+        self.pool = get_sqlite_pool(self.db_path)
+        self.create_tables()
+
+    def create_tables(self):
+        with self.pool.exclusive() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chunks (
+                    rowid INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    source TEXT,
+                    content TEXT NOT NULL,
+                    metadata TEXT NOT NULL,
+                    document_id INTEGER,
+                    uploaded_at REAL
+                )
+            """)
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(chunks)")]
+            for column, column_type in (("document_id", "INTEGER"), ("uploaded_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE chunks ADD COLUMN {column} {column_type}")
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chunks_source ON chunks (source)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_chunks_document ON chunks (document_id)
+            """)
+            conn.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(content, content='chunks', content_rowid='rowid')
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_insert AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts (rowid, content) VALUES (new.rowid, new.content);
+                END
+            """)
+            conn.execute("""
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_delete AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts (chunks_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+                END
+            """)
+
+    def add(self, ids: list[str], texts: list[str], metadatas: list[dict]):
+        with self.pool.connection() as conn:
+            conn.executemany("""
+                INSERT OR IGNORE INTO chunks (chunk_id, source, content, metadata, document_id, uploaded_at) VALUES (?, ?, ?, ?, ?, ?)
+            """, [
+                (chunk_id, metadata.get("source"), text, json.dumps(metadata), metadata.get("document_id"), metadata.get("uploaded_at"))
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)
+            ])
+
+    def update(self, ids: list[str], metadatas: list[dict]):
+        # Only metadata changes for chunks kept across a re-upload; the indexed text stays as is.
+        with self.pool.connection() as conn:
+            conn.executemany("""
+                UPDATE chunks SET source = ?, metadata = ?, document_id = ?, uploaded_at = ? WHERE chunk_id = ?
+            """, [
+                (metadata.get("source"), json.dumps(metadata), metadata.get("document_id"), metadata.get("uploaded_at"), chunk_id)
+                for chunk_id, metadata in zip(ids, metadatas)
+            ])
+
+    def delete(self, ids: list[str]):
+        with self.pool.connection() as conn:
+            conn.executemany("DELETE FROM chunks WHERE chunk_id = ?", [(chunk_id,) for chunk_id in ids])
+
+    def delete_source(self, source: str):
+        with self.pool.connection() as conn:
+            return conn.execute("DELETE FROM chunks WHERE source = ?", (source,)).rowcount
+
+    def sources(self):
+        with self.pool.connection() as conn:
+            return [row[0] for row in conn.execute("SELECT DISTINCT source FROM chunks")]
+
+    def clear(self):
+        with self.pool.connection() as conn:
+            conn.execute("DELETE FROM chunks")
+
+    def count(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    @staticmethod
+    def _filter_clause(filters: dict):
+        conditions, params = [], []
+        if filters.get("document_ids") is not None:
+            conditions.append(f"chunks.document_id IN ({','.join('?' * len(filters['document_ids']))})")
+            params += filters["document_ids"]
+        if filters.get("uploaded_after") is not None:
+            conditions.append("chunks.uploaded_at >= ?")
+            params.append(filters["uploaded_after"])
+        if filters.get("uploaded_before") is not None:
+            conditions.append("chunks.uploaded_at <= ?")
+            params.append(filters["uploaded_before"])
+        return "".join(f" AND {condition}" for condition in conditions), params
+
+    def search(self, queries: list[str], k: int = 3, filters: dict = None):
+        """Returns one ranked list of (chunk id, text, metadata, bm25 score) per query; higher scores are better.
+
+        filters may restrict results to document_ids and an uploaded_after/uploaded_before epoch range.
+        """
+        filter_sql, filter_params = self._filter_clause(filters or {})
+        ranked_lists = []
+        with self.pool.connection() as conn:
+            for query in queries:
+                # Terms are quoted and OR-ed, so punctuation in identifiers and error codes cannot break the FTS syntax.
+                terms = re.findall(r"\w+", query)
+                if not terms:
+                    ranked_lists.append([])
+                    continue
+                rows = conn.execute(f"""
+                    SELECT chunks.chunk_id, chunks.content, chunks.metadata, bm25(chunks_fts) AS score
+                    FROM chunks_fts JOIN chunks ON chunks.rowid = chunks_fts.rowid
+                    WHERE chunks_fts MATCH ?{filter_sql}
+                    ORDER BY score LIMIT ?
+                """, (" OR ".join(f'"{term}"' for term in terms), *filter_params, k)).fetchall()
+                ranked_lists.append([(chunk_id, text, json.loads(metadata), -score) for chunk_id, text, metadata, score in rows])
+        return ranked_lists
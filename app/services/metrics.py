@@ -0,0 +1,81 @@
+from prometheus_client import Counter, Gauge, Histogram
+from contextlib import contextmanager
+import contextvars
+import threading
+import time
+
+# Conversion of a large PDF can take minutes, so the buckets reach further than the client defaults.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage per chat request or ingest batch.",
+    ["stage"], buckets=DURATION_BUCKETS
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_duration_seconds", "HTTP request latency by route.",
+    ["method", "route", "status_code"], buckets=DURATION_BUCKETS
+)
+CHUNKS_INGESTED = Counter("rag_chunks_ingested", "Chunks of ingested documents, by whether they were newly embedded or kept.", ["result"])
+DOCUMENTS_INGESTED = Counter("rag_documents_ingested", "Documents leaving the ingest queue, by final status.", ["status"])
+CACHE_LOOKUPS = Counter("rag_cache_lookups", "Cache lookups by cache and result.", ["cache", "result"])
+LLM_TOKENS = Counter("rag_llm_tokens", "Estimated tokens exchanged with the chat model, by prompt part.", ["part"])
+EMBED_BATCH_SIZE = Histogram(
+    "rag_embedding_batch_size", "Texts per embedding forward pass, by query or document embedding.",
+    ["kind"], buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256)
+)
+EMBED_QUEUE_WAIT = Histogram(
+    "rag_embedding_queue_wait_seconds", "Time an embedding request waited for its micro-batch, by priority.",
+    ["priority"], buckets=DURATION_BUCKETS
+)
+INGEST_QUEUE_DEPTH = Gauge("rag_ingest_queue_depth", "Ingest jobs queued or in progress.", multiprocess_mode="livemostrecent")
+
+_timings = contextvars.ContextVar("stage_timings", default=None)
+_lock = threading.Lock()
+_END = object()
+
+def record(stage: str, seconds: float):
+    timings = _timings.get()
+    if timings is None:
+        STAGE_SECONDS.labels(stage).observe(seconds)
+        return
+    with _lock:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds * 1000, 2)
+
+@contextmanager
+def span(stage: str):
+    """Times a stage into the enclosing collect_timings() scope, or straight into the histogram outside one."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+@contextmanager
+def collect_timings(observe: bool = True):
+    """Accumulates span durations as milliseconds per stage, e.g. to attach them to a request's log line.
+
+    Stages that run several times (one embedding call per query) are summed. With observe=False the caller
+    reports them through observe_timings instead, e.g. once they have crossed back from a worker process.
+    """
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        if observe:
+            observe_timings(timings)
+
+def observe_timings(timings: dict):
+    for stage, duration_ms in timings.items():
+        STAGE_SECONDS.labels(stage).observe(duration_ms / 1000)
+
+def timed_iter(iterable, stage: str):
+    """Yields from iterable, timing only the work done to produce each item (e.g. a lazy converter)."""
+    iterator = iter(iterable)
+    while True:
+        with span(stage):
+            item = next(iterator, _END)
+        if item is _END:
+            return
+        yield item
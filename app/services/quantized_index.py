@@ -0,0 +1,494 @@
+from app.services.storage import COLLECTION_NAME, get_chroma_client, get_sqlite_pool
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import numpy as np
+import threading
+import argparse
+import logging
+import json
+import re
+import os
+
+QUANTIZED_DTYPES = ("int8", "float16")
+_COMPARISONS = {"$eq": "=", "$ne": "!=", "$gt": ">", "$gte": ">=", "$lt": "<", "$lte": "<="}
+
+logger = logging.getLogger(__name__)
+
+def _where_sql(where: dict):
+    """Translates a Chroma-style where filter into SQL over the stored metadata JSON."""
+    clauses, params = [], []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            parts = [_where_sql(condition) for condition in value]
+            clauses.append("(" + f" {key[1:].upper()} ".join(sql for sql, _ in parts) + ")")
+            for _, part_params in parts:
+                params += part_params
+            continue
+        if not re.fullmatch(r"\w+", key):
+            raise ValueError(f"Unsupported metadata key in where filter: '{key}'")
+        field = f"json_extract(metadata, '$.{key}')"
+        for operator, operand in (value.items() if isinstance(value, dict) else [("$eq", value)]):
+            if operator in ("$in", "$nin"):
+                clauses.append(f"{field} {'NOT IN' if operator == '$nin' else 'IN'} ({','.join('?' * len(operand))})")
+                params += list(operand)
+            elif operator in _COMPARISONS:
+                clauses.append(f"{field} {_COMPARISONS[operator]} ?")
+                params.append(operand)
+            else:
+                raise ValueError(f"Unsupported where operator: '{operator}'")
+    return " AND ".join(clauses) or "1", params
+
+class _Segment:
+    """One append-only run of vectors: quantized codes for the scan, float32 originals for the rescore,
+    and a (scale, squared norm) pair per row. Rows are never rewritten; deletes only clear the live mask."""
+
+    def __init__(self, directory: str, number: int, dim: int, dtype: str):
+        self.number = number
+        # Queries pin the segments they scan; a retired segment's files are removed once none pins it.
+        self.readers = 0
+        self.retired = False
+        self.dim = dim
+        self.dtypes = {"codes": np.dtype(dtype), "f32": np.dtype(np.float32), "aux": np.dtype(np.float32)}
+        self.widths = {"codes": dim, "f32": dim, "aux": 2}
+        self.paths = {name: os.path.join(directory, f"{number:06d}.{name}") for name in self.dtypes}
+        self.live = np.zeros(0, dtype=bool)
+        self._open()
+
+    def _row_bytes(self, name: str):
+        return self.dtypes[name].itemsize * self.widths[name]
+
+    def _open(self):
+        # A crash mid-append can leave the files at different lengths; rows past the shortest are dropped.
+        for path in self.paths.values():
+            open(path, "ab").close()
+        rows = min(os.path.getsize(self.paths[name]) // self._row_bytes(name) for name in self.paths)
+        for name, path in self.paths.items():
+            if os.path.getsize(path) != rows * self._row_bytes(name):
+                os.truncate(path, rows * self._row_bytes(name))
+        self._map(rows)
+
+    def _map(self, rows: int):
+        maps = {}
+        for name, path in self.paths.items():
+            shape = (rows, self.widths[name])
+            maps[name] = np.memmap(path, dtype=self.dtypes[name], mode="r", shape=shape) if rows else np.zeros(shape, self.dtypes[name])
+        # The live mask grows before the arrays, so a concurrent scan never reads past it.
+        if len(self.live) < rows:
+            self.live = np.concatenate([self.live, np.zeros(rows - len(self.live), dtype=bool)])
+        self.codes, self.f32, self.aux = maps["codes"], maps["f32"], maps["aux"]
+        self.rows = rows
+
+    def append(self, codes, vectors, aux):
+        for name, array in (("codes", codes), ("f32", vectors), ("aux", aux)):
+            with open(self.paths[name], "ab") as f:
+                f.write(np.ascontiguousarray(array, dtype=self.dtypes[name]).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        start = self.rows
+        self._map(self.rows + len(codes))
+        return start
+
+    def remove(self):
+        self.codes = self.f32 = self.aux = None
+        for path in self.paths.values():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class QuantizedIndex:
+    """Memory-mapped int8/float16 vector index with exact float32 rescoring, usable in place of the Chroma collection.
+
+    It implements the subset of chromadb's Collection API that Ingester and Retriever use (add, update, delete,
+    get, query, count) with the same l2 distances. Vectors live in append-only segment files that the OS pages
+    in on demand; ids, texts and metadata live in SQLite, which is also the source of truth for which rows are live.
+    """
+
+    def __init__(self, directory: str = None, dtype: str = None, rescore: bool = None):
+        load_dotenv()
+        self.directory = directory or os.path.join(os.getenv("DATA_DIR"), "quantized_index")
+        os.makedirs(self.directory, exist_ok=True)
+        self.rescore = rescore if rescore is not None else os.getenv("QUANTIZED_RESCORE", "true").lower() in ("1", "true", "yes")
+        self.rescore_factor = int(os.getenv("QUANTIZED_RESCORE_FACTOR", "4"))
+        self.segment_rows = int(os.getenv("QUANTIZED_SEGMENT_ROWS", "100000"))
+        self.scan_block_rows = int(os.getenv("QUANTIZED_SCAN_BLOCK_ROWS", "4096"))
+        self.compact_ratio = float(os.getenv("QUANTIZED_COMPACT_RATIO", "0.3"))
+        self.max_batch_size = int(os.getenv("QUANTIZED_MAX_BATCH_SIZE", "5000"))
+        self.name = COLLECTION_NAME
+        self.metadata = {"hnsw:space": "l2"}
+        self.pool = get_sqlite_pool(os.path.join(self.directory, "index.db"))
+        self.lock = threading.RLock()
+        self.snapshot_lock = threading.Lock()
+        self.create_tables()
+
+        requested = dtype or os.getenv("QUANTIZED_DTYPE", "int8")
+        if requested not in QUANTIZED_DTYPES:
+            raise ValueError(f"QUANTIZED_DTYPE must be one of {QUANTIZED_DTYPES}, got '{requested}'.")
+        self.dtype = self._setting("dtype") or requested
+        if self.dtype != requested:
+            logger.warning(f"Quantized index at {self.directory} stores {self.dtype} codes; ignoring QUANTIZED_DTYPE={requested}.")
+        dim = self._setting("dim")
+        self.dim = int(dim) if dim else None
+        self.segments = {}
+        self._load_segments()
+
+    def create_tables(self):
+        with self.pool.connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vectors (
+                    rowid INTEGER PRIMARY KEY,
+                    chunk_id TEXT NOT NULL UNIQUE,
+                    segment INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    document TEXT,
+                    metadata TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_vectors_location ON vectors (segment, position)
+            """)
+            conn.execute("""
+                CREATE INDEX IF NOT EXISTS idx_vectors_source ON vectors (json_extract(metadata, '$.source'))
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS settings (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                )
+            """)
+
+    def _setting(self, key: str):
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT value FROM settings WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_setting(self, key: str, value):
+        with self.pool.connection() as conn:
+            conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def _load_segments(self):
+        if self.dim is None:
+            return
+        numbers = sorted({int(name.split(".")[0]) for name in os.listdir(self.directory) if re.fullmatch(r"\d{6}\.(codes|f32|aux)", name)})
+        self.segments = {number: _Segment(self.directory, number, self.dim, self.dtype) for number in numbers}
+        # Rows that SQLite does not reference are tombstones (deleted, or written by an interrupted add).
+        with self.pool.connection() as conn:
+            for number, position in conn.execute("SELECT segment, position FROM vectors"):
+                segment = self.segments.get(number)
+                if segment is not None and position < segment.rows:
+                    segment.live[position] = True
+
+    @contextmanager
+    def _snapshot(self):
+        """Pins the current segments for one read. Writers replace self.segments instead of mutating it,
+        so a read keeps a consistent set of segments while compaction or reset swaps in new ones."""
+        with self.snapshot_lock:
+            segments = self.segments
+            for segment in segments.values():
+                segment.readers += 1
+        try:
+            yield segments
+        finally:
+            released = []
+            with self.snapshot_lock:
+                for segment in segments.values():
+                    segment.readers -= 1
+                    if segment.retired and not segment.readers:
+                        released.append(segment)
+            for segment in released:
+                segment.remove()
+
+    def _retire(self, segments: list):
+        # Called once the segments are no longer in self.segments, so no new read can pin them.
+        with self.snapshot_lock:
+            for segment in segments:
+                segment.retired = True
+            idle = [segment for segment in segments if not segment.readers]
+        for segment in idle:
+            segment.remove()
+
+    def _quantize(self, vectors):
+        sq_norms = np.einsum("ij,ij->i", vectors, vectors)
+        if self.dtype == "float16":
+            return vectors.astype(np.float16), np.column_stack([np.ones(len(vectors), np.float32), sq_norms])
+        # Symmetric per-vector scaling keeps every row's largest component at full int8 resolution.
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.round(vectors / scales[:, None]).astype(np.int8)
+        return codes, np.column_stack([scales, sq_norms])
+
+    def _append(self, vectors):
+        """Appends float32 vectors to the open segment (starting new ones as they fill); returns (segment, position) per row."""
+        codes, aux = self._quantize(vectors)
+        locations = []
+        start = 0
+        while start < len(vectors):
+            segment = self.segments[max(self.segments)] if self.segments else None
+            if segment is None or segment.rows >= self.segment_rows:
+                number = max(self.segments) + 1 if self.segments else 1
+                segment = _Segment(self.directory, number, self.dim, self.dtype)
+                self.segments = {**self.segments, number: segment}
+            end = min(len(vectors), start + self.segment_rows - segment.rows)
+            first = segment.append(codes[start:end], vectors[start:end], aux[start:end])
+            locations += [(segment.number, first + offset) for offset in range(end - start)]
+            start = end
+        return locations
+
+    def _set_live(self, locations: list[tuple], live: bool):
+        for number, position in locations:
+            segment = self.segments.get(number)
+            if segment is not None and position < segment.rows:
+                segment.live[position] = live
+
+    def count(self):
+        with self.pool.connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def add(self, ids: list[str], embeddings, documents: list[str] = None, metadatas: list[dict] = None):
+        with self.lock:
+            existing = set(self.get(ids=list(ids), include=[])["ids"])
+            keep, seen = [], set()
+            for i, chunk_id in enumerate(ids):
+                if chunk_id not in existing and chunk_id not in seen:
+                    seen.add(chunk_id)
+                    keep.append(i)
+            if not keep:
+                return
+            vectors = np.asarray([embeddings[i] for i in keep], dtype=np.float32)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+                self._set_setting("dim", self.dim)
+                self._set_setting("dtype", self.dtype)
+            if vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match the index dimension {self.dim}.")
+            # Vectors are durable before their rows exist, so a crash in between only leaves tombstones.
+            locations = self._append(vectors)
+            with self.pool.connection() as conn:
+                conn.executemany("""
+                    INSERT INTO vectors (chunk_id, segment, position, document, metadata) VALUES (?, ?, ?, ?, ?)
+                """, [
+                    (ids[i], number, position, documents[i] if documents else None, json.dumps(metadatas[i] if metadatas else {}))
+                    for i, (number, position) in zip(keep, locations)
+                ])
+            self._set_live(locations, True)
+
+    def update(self, ids: list[str], embeddings=None, documents: list[str] = None, metadatas: list[dict] = None):
+        """Merges metadata like Chroma (a None value removes the key); new embeddings re-append the rows."""
+        with self.lock:
+            if embeddings is not None:
+                current = self.get(ids=list(ids), include=["documents", "metadatas"])
+                by_id = dict(zip(current["ids"], zip(current["documents"], current["metadatas"])))
+                present = [i for i, chunk_id in enumerate(ids) if chunk_id in by_id]
+                merged = [{**by_id[ids[i]][1], **(metadatas[i] if metadatas else {})} for i in present]
+                self.delete(ids=[ids[i] for i in present])
+                self.add(
+                    [ids[i] for i in present],
+                    [embeddings[i] for i in present],
+                    [documents[i] if documents else by_id[ids[i]][0] for i in present],
+                    [{key: value for key, value in metadata.items() if value is not None} for metadata in merged]
+                )
+                return
+            with self.pool.connection() as conn:
+                if metadatas:
+                    conn.executemany("UPDATE vectors SET metadata = json_patch(metadata, ?) WHERE chunk_id = ?", [
+                        (json.dumps(metadata), chunk_id) for chunk_id, metadata in zip(ids, metadatas)
+                    ])
+                if documents:
+                    conn.executemany("UPDATE vectors SET document = ? WHERE chunk_id = ?", list(zip(documents, ids)))
+
+    def _select(self, columns: str, ids: list[str] = None, where: dict = None, limit: int = None, offset: int = None):
+        conditions, params = [], []
+        if ids is not None:
+            conditions.append(f"chunk_id IN ({','.join('?' * len(ids))})")
+            params += ids
+        if where:
+            sql, where_params = _where_sql(where)
+            conditions.append(sql)
+            params += where_params
+        query = f"SELECT {columns} FROM vectors WHERE {' AND '.join(conditions) or '1'} ORDER BY rowid"
+        if limit is not None or offset:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit if limit is not None else -1, offset or 0]
+        with self.pool.connection() as conn:
+            return conn.execute(query, params).fetchall()
+
+    def delete(self, ids: list[str] = None, where: dict = None):
+        if ids is None and not where:
+            return
+        with self.lock:
+            rows = self._select("rowid, segment, position", ids=ids, where=where)
+            with self.pool.connection() as conn:
+                conn.executemany("DELETE FROM vectors WHERE rowid = ?", [(row[0],) for row in rows])
+            self._set_live([(number, position) for _, number, position in rows], False)
+
+    def _vectors(self, locations: list[tuple], segments: dict):
+        return np.asarray([segments[number].f32[position] for number, position in locations], dtype=np.float32).reshape(-1, self.dim or 0)
+
+    def get(self, ids: list[str] = None, where: dict = None, limit: int = None, offset: int = None, include: list[str] = None):
+        include = ["metadatas", "documents"] if include is None else include
+        if "embeddings" in include:
+            # Rows and vectors are read under the writer lock, so compaction cannot move rows in between.
+            with self.lock:
+                rows = self._select("chunk_id, document, metadata, segment, position", ids=ids, where=where, limit=limit, offset=offset)
+                embeddings = self._vectors([(row[3], row[4]) for row in rows], self.segments)
+        else:
+            rows = self._select("chunk_id, document, metadata, segment, position", ids=ids, where=where, limit=limit, offset=offset)
+            embeddings = None
+        return {
+            "ids": [row[0] for row in rows],
+            "documents": [row[1] for row in rows] if "documents" in include else None,
+            "metadatas": [json.loads(row[2]) for row in rows] if "metadatas" in include else None,
+            "embeddings": embeddings,
+        }
+
+    def _allowed(self, where: dict, segments: dict):
+        masks = {}
+        for number, position in self._select("segment, position", where=where):
+            segment = segments.get(number)
+            if segment is None:
+                continue
+            mask = masks.setdefault(number, np.zeros(segment.rows, dtype=bool))
+            if position < len(mask):
+                mask[position] = True
+        return masks
+
+    def _scan(self, queries, candidates: int, segments: dict, allowed: dict = None):
+        """Approximate l2 distances over the quantized codes, block by block; returns the best candidates per query
+        as (distances, segment numbers, positions) arrays of shape (queries, candidates)."""
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        best = [np.full((len(queries), 0), np.inf, np.float32), np.zeros((len(queries), 0), np.int64), np.zeros((len(queries), 0), np.int64)]
+        for segment in segments.values():
+            codes, aux, live = segment.codes, segment.aux, segment.live
+            rows = min(len(codes), len(aux), len(live))
+            mask = allowed.get(segment.number) if allowed is not None else None
+            if allowed is not None and mask is None:
+                continue
+            if mask is not None and len(mask) < rows:
+                # Rows appended after the filter was read were not in its result.
+                mask = np.concatenate([mask, np.zeros(rows - len(mask), dtype=bool)])
+            for start in range(0, rows, self.scan_block_rows):
+                end = min(rows, start + self.scan_block_rows)
+                dots = np.asarray(codes[start:end], dtype=np.float32) @ queries.T
+                block_aux = np.asarray(aux[start:end])
+                distances = block_aux[:, 1:2] + q_norms[None, :] - 2 * block_aux[:, 0:1] * dots
+                valid = live[start:end] if mask is None else live[start:end] & mask[start:end]
+                distances[~valid] = np.inf
+                take = min(candidates, end - start)
+                top = np.argpartition(distances, take - 1, axis=0)[:take]
+                best[0] = np.concatenate([best[0], np.take_along_axis(distances, top, axis=0).T], axis=1)
+                best[1] = np.concatenate([best[1], np.full((len(queries), take), segment.number)], axis=1)
+                best[2] = np.concatenate([best[2], (top + start).T], axis=1)
+                if best[0].shape[1] > candidates:
+                    keep = np.argpartition(best[0], candidates - 1, axis=1)[:, :candidates]
+                    best = [np.take_along_axis(array, keep, axis=1) for array in best]
+        return best
+
+    def query(self, query_embeddings, n_results: int = 10, where: dict = None, include: list[str] = None):
+        include = ["metadatas", "documents", "distances"] if include is None else include
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        results = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if self.dim is None or not len(queries):
+            return {key: [[] for _ in queries] for key in results}
+        candidates = n_results * self.rescore_factor if self.rescore else n_results
+
+        locations = {}
+        with self._snapshot() as segments:
+            distances, numbers, positions = self._scan(queries, candidates, segments, self._allowed(where, segments) if where else None)
+            for query, row_distances, row_numbers, row_positions in zip(queries, distances, numbers, positions):
+                found = [(float(d), int(n), int(p)) for d, n, p in zip(row_distances, row_numbers, row_positions) if np.isfinite(d)]
+                if self.rescore and found:
+                    # Exact float32 distances for the shortlist; only these rows' pages of the .f32 files are read.
+                    exact = self._vectors([(n, p) for _, n, p in found], segments) - query
+                    found = [(float(d), n, p) for d, (_, n, p) in zip(np.einsum("ij,ij->i", exact, exact), found)]
+                found = sorted(found)[:n_results]
+                results["distances"].append([d for d, _, _ in found])
+                results["ids"].append([(n, p) for _, n, p in found])
+                locations.update({(n, p): None for _, n, p in found})
+
+        if locations:
+            with self.pool.connection() as conn:
+                keys = list(locations)
+                for start in range(0, len(keys), 400):
+                    batch = keys[start:start + 400]
+                    for number, position, chunk_id, document, metadata in conn.execute(f"""
+                        SELECT segment, position, chunk_id, document, metadata FROM vectors
+                        WHERE (segment, position) IN (VALUES {','.join(['(?, ?)'] * len(batch))})
+                    """, [value for key in batch for value in key]):
+                        locations[(number, position)] = (chunk_id, document, json.loads(metadata))
+        # A row deleted between the scan and the lookup has no record any more and is dropped.
+        for i, (row_keys, row_distances) in enumerate(zip(results["ids"], results["distances"])):
+            hits = [(locations[key], distance) for key, distance in zip(row_keys, row_distances) if locations[key] is not None]
+            results["ids"][i] = [record[0] for record, _ in hits]
+            results["documents"].append([record[1] for record, _ in hits])
+            results["metadatas"].append([record[2] for record, _ in hits])
+            results["distances"][i] = [distance for _, distance in hits]
+        return {key: (value if key == "ids" or key in include else None) for key, value in results.items()}
+
+    def compact(self):
+        """Rewrites sealed segments whose tombstoned share exceeds QUANTIZED_COMPACT_RATIO; returns how many were rewritten."""
+        with self.lock:
+            open_number = max(self.segments) if self.segments else None
+            stale = [
+                segment for number, segment in self.segments.items()
+                if number != open_number and segment.rows and 1 - segment.live[:segment.rows].mean() >= self.compact_ratio
+            ]
+            for segment in stale:
+                positions = np.flatnonzero(segment.live[:segment.rows])
+                moves = []
+                if len(positions):
+                    locations = self._append(np.asarray(segment.f32[positions], dtype=np.float32))
+                    moves = [(number, new_position, segment.number, int(position)) for (number, new_position), position in zip(locations, positions)]
+                with self.pool.connection() as conn:
+                    conn.executemany("UPDATE vectors SET segment = ?, position = ? WHERE segment = ? AND position = ?", moves)
+                self._set_live([(number, new_position) for number, new_position, _, _ in moves], True)
+                self.segments = {number: kept for number, kept in self.segments.items() if number != segment.number}
+                self._retire([segment])
+            if stale:
+                logger.info(f"Compacted {len(stale)} quantized index segments.")
+            return len(stale)
+
+    def reset(self):
+        with self.lock:
+            with self.pool.connection() as conn:
+                conn.execute("DELETE FROM vectors")
+                conn.execute("DELETE FROM settings")
+            removed = list(self.segments.values())
+            self.segments = {}
+            self._retire(removed)
+            self.dim = None
+
+_quantized_index = None
+_quantized_lock = threading.Lock()
+
+def get_quantized_index():
+    global _quantized_index
+    with _quantized_lock:
+        if _quantized_index is None:
+            _quantized_index = QuantizedIndex()
+        return _quantized_index
+
+def migrate_from_chroma(index: QuantizedIndex, page_size: int = 1000):
+    """Copies every vector, text and metadata record from the Chroma collection; ids already in the index are skipped."""
+    collection = get_chroma_client().get_or_create_collection(COLLECTION_NAME)
+    total = collection.count()
+    before = index.count()
+    offset = 0
+    while True:
+        page = collection.get(limit=page_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+        if not page["ids"]:
+            break
+        index.add(page["ids"], page["embeddings"], page["documents"], [metadata or {} for metadata in page["metadatas"]])
+        offset += len(page["ids"])
+        logger.info(f"Read {offset} of {total} vectors from Chroma.")
+    return index.count() - before
+
+if __name__ == "__main__":
+    # Run with the API stopped, then start it with VECTOR_BACKEND=quantized.
+    parser = argparse.ArgumentParser(description="Migrate the Chroma collection into the quantized index.")
+    parser.add_argument("--page-size", type=int, default=1000)
+    parser.add_argument("--dtype", choices=QUANTIZED_DTYPES)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    index = QuantizedIndex(dtype=args.dtype)
+    migrated = migrate_from_chroma(index, args.page_size)
+    print(f"Migrated {migrated} new vectors into {index.directory} ({index.dtype}, {index.count()} in total).")
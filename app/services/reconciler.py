@@ -0,0 +1,95 @@
+from app.services.database import Database
+from app.services.document_ingester import Ingester
+from collections import defaultdict
+from pathlib import Path
+from dotenv import load_dotenv
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+class Reconciler:
+    """Finds vectors, lexical entries, upload files and database rows that no longer belong to a document, and removes them in batches."""
+
+    def __init__(self, ingester: Ingester, database: Database, upload_dir: str):
+        load_dotenv()
+        self.ingester = ingester
+        self.database = database
+        self.upload_dir = upload_dir
+        self.page_size = int(os.getenv("RECONCILE_PAGE_SIZE", "1000"))
+        # Files younger than this may belong to an upload that is not registered yet.
+        self.file_grace_seconds = float(os.getenv("RECONCILE_FILE_GRACE_SECONDS", "3600"))
+
+    def _known_sources(self):
+        return {str(Path(path).resolve()) for path in self.database.list_document_paths()}
+
+    def _orphan_rows(self, dry_run: bool):
+        # Rows whose file is gone can never be (re-)ingested; drop them together with their chunks.
+        removed = 0
+        for path in self.database.list_document_paths():
+            if os.path.exists(path):
+                continue
+            if not dry_run:
+                chunk_ids = self.database.list_document_chunks(path)
+                self.ingester.delete_document(path, chunk_ids=chunk_ids)
+                self.database.delete_document(path)
+            removed += 1
+        return removed
+
+    def _orphan_vectors(self, dry_run: bool):
+        known = self._known_sources()
+        candidates = defaultdict(list)
+        for page in self.ingester.iter_chunks(self.page_size, include=["metadatas"]):
+            for chunk_id, metadata in zip(page["ids"], page["metadatas"]):
+                source = (metadata or {}).get("source")
+                if source not in known:
+                    candidates[source].append(chunk_id)
+        # Documents registered while the scan was running are not orphans.
+        known = self._known_sources()
+        orphan_ids = [chunk_id for source, ids in candidates.items() if source not in known for chunk_id in ids]
+        if orphan_ids and not dry_run:
+            self.ingester.delete_chunks(orphan_ids)
+        return len(orphan_ids)
+
+    def _orphan_lexical(self, dry_run: bool):
+        known = self._known_sources()
+        orphan_sources = [source for source in self.ingester.lexical_index.sources() if source not in known]
+        if not dry_run:
+            for source in orphan_sources:
+                self.ingester.lexical_index.delete_source(source)
+        return len(orphan_sources)
+
+    def _orphan_files(self, dry_run: bool):
+        if not os.path.isdir(self.upload_dir):
+            return 0
+        known = self._known_sources()
+        cutoff = time.time() - self.file_grace_seconds
+        removed = 0
+        with os.scandir(self.upload_dir) as entries:
+            for entry in entries:
+                # Abandoned ".upload-*.part" temp files are never registered, so they fall out here too.
+                if not entry.is_file() or entry.stat().st_mtime > cutoff or str(Path(entry.path).resolve()) in known:
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        continue
+                removed += 1
+        return removed
+
+    def run(self, dry_run: bool = False):
+        started = time.perf_counter()
+        summary = {
+            "orphan_rows": self._orphan_rows(dry_run),
+            "orphan_vectors": self._orphan_vectors(dry_run),
+            "orphan_lexical_sources": self._orphan_lexical(dry_run),
+            "orphan_files": self._orphan_files(dry_run),
+            "orphan_chunk_records": 0 if dry_run else self.database.delete_orphan_chunk_rows(),
+            "compacted_segments": 0 if dry_run else self.ingester.compact_vectors(),
+            "dry_run": dry_run,
+        }
+        summary["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info("Reconciliation completed", extra={"extra": summary})
+        return summary
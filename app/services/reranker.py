@@ -0,0 +1,25 @@
+from sentence_transformers import CrossEncoder
+from langchain_core.documents import Document
+from dotenv import load_dotenv
+import os
+
+DEFAULT_RERANK_MODEL = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+
+class Reranker:
+    """Scores (question, chunk) pairs with a small cross-encoder on CPU."""
+
+    def __init__(self, model_name: str = None):
+        load_dotenv()
+        self.model_name = model_name or os.getenv("RERANK_MODEL", DEFAULT_RERANK_MODEL)
+        self.batch_size = int(os.getenv("RERANK_BATCH_SIZE", "32"))
+        self.model = CrossEncoder(self.model_name, device="cpu")
+
+    def rerank(self, query: str, documents: list[Document]) -> list[tuple[Document, float]]:
+        if not documents:
+            return []
+        scores = self.model.predict(
+            [(query, doc.page_content) for doc in documents],
+            batch_size=self.batch_size,
+            show_progress_bar=False
+        )
+        return sorted(zip(documents, (float(score) for score in scores)), key=lambda pair: pair[1], reverse=True)
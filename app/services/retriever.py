@@ -1,33 +1,152 @@
-from langchain_chroma.vectorstores import Chroma
-from langchain_huggingface.embeddings import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from langchain_core.documents import Document
+from app.services.embeddings import CachedEmbeddings
+from app.services.storage import get_vector_collection
+from app.services.lexical_index import LexicalIndex
+from app.services.reranker import Reranker
+from app.services.context_builder import ContextBuilder
+from app.services.metrics import CACHE_LOOKUPS, span
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
+from functools import partial
+import contextvars
+import asyncio
+import hashlib
+import threading
+import logging
+import time
 import os
 
+REWRITE_MODES = ("off", "always", "adaptive", "pipelined")
+RETRIEVAL_MODES = ("dense", "hybrid")
+
 class Retriever:
-    def __init__(self, embedding_model:HuggingFaceEmbeddings=None):
-        self.embed= embedding_model if embedding_model else HuggingFaceEmbeddings(
-            model_name="sentence-transformers/all-MiniLM-L6-v2"
-        )
+    def __init__(self, embedding_model:Embeddings=None, context_builder:ContextBuilder=None):
+        self.embed= embedding_model if embedding_model else CachedEmbeddings()
+        self.context_builder= context_builder if context_builder else ContextBuilder()
         load_dotenv()
         self.DATA_DIR = os.getenv("DATA_DIR")
-        self.vector_store=Chroma(
-            collection_name="documents_collection",
-            embedding_function=self.embed,
-            persist_directory=os.path.join(self.DATA_DIR,"chroma_db")
-        )
+        # Opened up front so a misconfigured backend fails at startup rather than on the first query.
+        get_vector_collection(self.embed)
+        self.lexical_index=LexicalIndex()
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", "hybrid")
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"RETRIEVAL_MODE must be one of {RETRIEVAL_MODES}, got '{self.retrieval_mode}'.")
+
+        # With reranking on, every search over-fetches and the cross-encoder picks the chunks that reach the prompt.
+        self.rerank_enabled = os.getenv("RERANK_ENABLED", "true").lower() in ("1", "true", "yes")
+        self.rerank_candidates = int(os.getenv("RERANK_CANDIDATES", "30"))
+        self.rerank_top_n = int(os.getenv("RERANK_TOP_N", "5"))
+        self.reranker = Reranker() if self.rerank_enabled else None
+        self.fetch_k = self.rerank_candidates if self.rerank_enabled else 3
 
         self.GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
         if self.GEMINI_API_KEY is None:
             raise ValueError("GOOGLE_API_KEY not found in environment variables.")
 
-    def _retrieve_chunks(self,query:str):
-        retrieved_chunks = self.vector_store.similarity_search(query,k=3)
-        return retrieved_chunks
-    
-    def _query_transformer(self,query:str):
+        # Embedding and Chroma queries are CPU-bound; the async path runs them on this bounded pool.
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(os.getenv("RETRIEVAL_WORKERS", "4")),
+            thread_name_prefix="retrieval"
+        )
+
+        self.rewrite_mode = os.getenv("QUERY_REWRITE_MODE", "always")
+        if self.rewrite_mode not in REWRITE_MODES:
+            raise ValueError(f"QUERY_REWRITE_MODE must be one of {REWRITE_MODES}, got '{self.rewrite_mode}'.")
+        self.rewrite_threshold = float(os.getenv("QUERY_REWRITE_THRESHOLD", "0.6"))
+        self.rewrite_cache_size = int(os.getenv("QUERY_REWRITE_CACHE_SIZE", "256"))
+        self.rewrite_cache = OrderedDict()
+        self.rewrite_lock = threading.Lock()
+        self.rewrite_deadline = float(os.getenv("QUERY_REWRITE_DEADLINE_MS", "1500")) / 1000
+        self.background_rewrites = set()
+        self.rewrite_text_chain = self._rewrite_chain()
+        self.rewrite_chain = (self.rewrite_text_chain
+                | (lambda x: x.strip().split("\n"))  # Split the output into a list of questions
+        )
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def collection(self):
+        return get_vector_collection(self.embed)
+
+    @staticmethod
+    def _where(filters: dict):
+        # Filters are pushed down into the Chroma query, so a scoped search never ranks chunks outside the scope.
+        conditions = []
+        if filters.get("document_ids") is not None:
+            conditions.append({"document_id": {"$in": list(filters["document_ids"])}})
+        if filters.get("uploaded_after") is not None:
+            conditions.append({"uploaded_at": {"$gte": filters["uploaded_after"]}})
+        if filters.get("uploaded_before") is not None:
+            conditions.append({"uploaded_at": {"$lte": filters["uploaded_before"]}})
+        if len(conditions) > 1:
+            return {"$and": conditions}
+        return conditions[0] if conditions else None
+
+    def _retrieve_chunks(self, queries: list[str], k: int = 3, filters: dict = None, known_embeddings: dict = None):
+        # Embed every query not embedded by the caller in one batch and search them as a single multi-vector query.
+        known = known_embeddings or {}
+        missing = [query for query in queries if query not in known]
+        with span("embed_query"):
+            computed = dict(zip(missing, self.embed.embed_documents(missing))) if missing else {}
+        query_embeddings = [known[query] if query in known else computed[query] for query in queries]
+        with span("vector_search"):
+            results = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=self._where(filters or {}),
+                include=["documents", "metadatas", "distances"]
+            )
+        ranked_lists = []
+        for ids, texts, metadatas, distances in zip(results["ids"], results["documents"], results["metadatas"], results["distances"]):
+            ranked_lists.append([
+                Document(id=chunk_id, page_content=text, metadata={**(metadata or {}), "score": self._similarity(distance)})
+                for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)
+            ])
+        return ranked_lists
+
+    def _retrieve_lexical(self, queries: list[str], k: int = 3, filters: dict = None):
+        with span("lexical_search"):
+            results = self.lexical_index.search(queries, k=k, filters=filters)
+        return [
+            [
+                Document(id=chunk_id, page_content=text, metadata={**metadata, "lexical_score": score})
+                for chunk_id, text, metadata, score in ranked
+            ]
+            for ranked in results
+        ]
+
+    def _search(self, queries: list[str], k: int = None, filters: dict = None, known_embeddings: dict = None):
+        # Hybrid mode appends a BM25 ranking per query after the dense ones; _fuse merges them all with RRF.
+        k = k or self.fetch_k
+        ranked_lists = self._retrieve_chunks(queries, k=k, filters=filters, known_embeddings=known_embeddings)
+        if self.retrieval_mode == "hybrid":
+            ranked_lists += self._retrieve_lexical(queries, k=k, filters=filters)
+        return ranked_lists
+
+    def _similarity(self, distance: float):
+        # MiniLM embeddings are unit length, so both distance spaces map onto cosine similarity.
+        space = (self.collection.metadata or {}).get("hnsw:space", "l2")
+        if space == "cosine":
+            return 1.0 - distance
+        return 1.0 - distance / 2.0
+
+    def _fuse(self, ranked_lists: list[list[Document]], k: int = 60):
+        # Reciprocal-rank fusion, deduplicating chunks by a hash of their content.
+        scores = {}
+        chunks = {}
+        for ranked in ranked_lists:
+            for rank, doc in enumerate(ranked):
+                key = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+                scores[key] = scores.get(key, 0.0) + 1.0 / (k + rank + 1)
+                chunks.setdefault(key, doc)
+        return [chunks[key] for key in sorted(scores, key=scores.get, reverse=True)]
+
+    def _rewrite_chain(self):
         template= """You are an AI language model assistant. Your task is to generate three 
 different versions of the given user question to retrieve relevant documents from a vector 
 database. By generating multiple perspectives on the user question, your goal is to help
@@ -38,29 +157,197 @@ Provide these alternative questions separated by newlines. Original question: {q
         chain= (prompt 
                 | llm
                 | StrOutputParser()
-                | (lambda x: x.strip().split("\n"))  # Split the output into a list of questions
         )
-        response= chain.invoke({"question": query})
+        return chain
+
+    def _rewrite_key(self, query: str):
+        return " ".join(query.lower().split())
+
+    def _cached_rewrites(self, query: str):
+        key = self._rewrite_key(query)
+        with self.rewrite_lock:
+            if key in self.rewrite_cache:
+                self.rewrite_cache.move_to_end(key)
+                CACHE_LOOKUPS.labels("query_rewrite", "hit").inc()
+                return self.rewrite_cache[key]
+        CACHE_LOOKUPS.labels("query_rewrite", "miss").inc()
+        return None
+
+    def _store_rewrites(self, query: str, rewrites: list[str]):
+        with self.rewrite_lock:
+            self.rewrite_cache[self._rewrite_key(query)] = rewrites
+            while len(self.rewrite_cache) > self.rewrite_cache_size:
+                self.rewrite_cache.popitem(last=False)
+
+    def _query_transformer(self,query:str):
+        response = self._cached_rewrites(query)
+        if response is None:
+            with span("query_rewrite"):
+                response= self.rewrite_chain.invoke({"question": query})
+            self._store_rewrites(query, response)
+        return response
+
+    async def _aquery_transformer(self, query: str):
+        response = self._cached_rewrites(query)
+        if response is None:
+            with span("query_rewrite"):
+                response = await self.rewrite_chain.ainvoke({"question": query})
+            self._store_rewrites(query, response)
         return response
 
-    def retrieve_context(self, query: str):
-        transformed_queries = self._query_transformer(query)
-        all_retrieved_chunks = []
-        for tq in transformed_queries:
-            chunks = self._retrieve_chunks(tq)
-            for chunk in chunks:
-                if chunk.page_content not in [c.page_content for c in all_retrieved_chunks]:
-                    all_retrieved_chunks.append(chunk)
-            
-        context = ""
-        citations = []
-        for idx, doc in enumerate(all_retrieved_chunks):
-            source = os.path.basename(doc.metadata.get("source", "Unknown"))
-            context += (f"Context {idx+1} (Source: {source}):\n{doc.page_content}\n{'-'*50}\n")
-            if source not in citations:
-                citations.append(source)
-                
-        return {"context": context, "citations": citations}
+    def _build_queries(self, query: str, transformed_queries: list[str]):
+        return list(dict.fromkeys(q.strip() for q in [query, *transformed_queries] if q.strip()))
+
+    def _needs_rewrite(self, mode: str, first_pass: list[list[Document]]):
+        if mode == "off":
+            return False
+        if mode == "adaptive":
+            top_score = max((doc.metadata["score"] for doc in first_pass[0]), default=0.0)
+            return top_score < self.rewrite_threshold
+        return True
+
+    def _rerank(self, query: str, chunks: list[Document]):
+        # The context builder then trims the top-N chunks to the context token budget.
+        selected = []
+        with span("rerank"):
+            ranked = self.reranker.rerank(query, chunks[:self.rerank_candidates])
+        for doc, score in ranked[:self.rerank_top_n]:
+            doc.metadata["rerank_score"] = score
+            selected.append(doc)
+        return selected
+
+    def _assemble(self, query: str, ranked_lists: list[list[Document]], started: float):
+        chunks = self._fuse(ranked_lists)
+        retrieved = time.perf_counter()
+        if self.reranker:
+            chunks = self._rerank(query, chunks)
+        result = self._build_context(chunks)
+        result["timings"] = {
+            "retrieval_ms": round((retrieved - started) * 1000, 2),
+            "rerank_ms": round((time.perf_counter() - retrieved) * 1000, 2) if self.reranker else None
+        }
+        return result
+
+    def _build_context(self, chunks):
+        return self.context_builder.build_context(chunks)
+
+    @staticmethod
+    def _empty_scope(filters: dict):
+        # Chroma rejects an empty $in, and nothing could match it anyway.
+        return filters is not None and filters.get("document_ids") == []
+
+    @staticmethod
+    def _known_embeddings(query: str, query_embedding: list[float] = None):
+        return {query: query_embedding} if query_embedding is not None else None
+
+    def retrieve_context(self, query: str, rewrite_mode: str = None, filters: dict = None, query_embedding: list[float] = None):
+        mode = rewrite_mode or self.rewrite_mode
+        started = time.perf_counter()
+        if self._empty_scope(filters):
+            return self._assemble(query, [], started)
+        search_chunks = partial(self._search, filters=filters, known_embeddings=self._known_embeddings(query, query_embedding))
+        # Pipelining needs the event loop, so the synchronous path treats it like "always".
+        if mode in ("always", "pipelined"):
+            queries = self._build_queries(query, self._query_transformer(query))
+            return self._assemble(query, search_chunks(queries), started)
+
+        # Search the raw question first; rewrite only if it retrieves weak context.
+        ranked_lists = search_chunks([query])
+        if self._needs_rewrite(mode, ranked_lists):
+            rewrites = self._build_queries(query, self._query_transformer(query))[1:]
+            if rewrites:
+                ranked_lists += search_chunks(rewrites)
+        return self._assemble(query, ranked_lists, started)
+
+    def _in_executor(self, loop, func, *args):
+        # Executor threads do not inherit the request's context; copying it lets their spans reach the request's timings.
+        return loop.run_in_executor(self.executor, contextvars.copy_context().run, func, *args)
+
+    async def _apipelined_retrieve(self, query: str, filters: dict = None, query_embedding: list[float] = None):
+        # Search the raw question while the rewrite is still streaming, search each rewrite as its
+        # line completes, and stop waiting for rewrites once the deadline passes.
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.rewrite_deadline
+        search_chunks = partial(self._search, filters=filters, known_embeddings=self._known_embeddings(query, query_embedding))
+        searches = [self._in_executor(loop, search_chunks, [query])]
+        seen = {self._rewrite_key(query)}
+
+        accepting = True
+
+        def search(line: str):
+            key = self._rewrite_key(line)
+            if accepting and key and key not in seen:
+                seen.add(key)
+                searches.append(self._in_executor(loop, search_chunks, [line.strip()]))
+
+        async def stream_rewrites():
+            cached = self._cached_rewrites(query)
+            if cached is not None:
+                for line in cached:
+                    search(line)
+                return
+            rewrites = []
+            buffer = ""
+            with span("query_rewrite"):
+                async for piece in self.rewrite_text_chain.astream({"question": query}):
+                    buffer += piece
+                    *lines, buffer = buffer.split("\n")
+                    for line in lines:
+                        rewrites.append(line)
+                        search(line)
+            rewrites.append(buffer)
+            search(buffer)
+            self._store_rewrites(query, [line for line in rewrites if line.strip()])
+
+        # The rewrite is shielded from the deadline: it keeps streaming in the background so its result is
+        # still memoized, and a repeat of the question gets the rewrites without waiting on the LLM again.
+        rewrite_task = asyncio.ensure_future(stream_rewrites())
+        try:
+            await asyncio.wait_for(asyncio.shield(rewrite_task), timeout=max(deadline - loop.time(), 0))
+        except asyncio.TimeoutError:
+            accepting = False
+            self.background_rewrites.add(rewrite_task)
+            rewrite_task.add_done_callback(self._finish_background_rewrite)
+            self.logger.info(f"Query rewrite missed the {self.rewrite_deadline}s deadline; using partial rewrites.")
+        except Exception as e:
+            self.logger.warning(f"Query rewrite failed, continuing with the raw question: {e}")
+
+        ranked_lists = list(await searches[0])
+        pending = searches[1:]
+        if pending:
+            done, _ = await asyncio.wait(pending, timeout=max(deadline - loop.time(), 0))
+            for task in pending:
+                if task in done and task.exception() is None:
+                    ranked_lists += task.result()
+        return ranked_lists
+
+    def _finish_background_rewrite(self, task: asyncio.Task):
+        self.background_rewrites.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            self.logger.warning(f"Background query rewrite failed: {task.exception()}")
+
+    async def aretrieve_context(self, query: str, rewrite_mode: str = None, filters: dict = None, query_embedding: list[float] = None):
+        """query_embedding, when the caller has already embedded query, saves embedding the raw question again."""
+        mode = rewrite_mode or self.rewrite_mode
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        if self._empty_scope(filters):
+            return self._assemble(query, [], started)
+        search_chunks = partial(self._search, filters=filters, known_embeddings=self._known_embeddings(query, query_embedding))
+        if mode == "pipelined":
+            ranked_lists = await self._apipelined_retrieve(query, filters=filters, query_embedding=query_embedding)
+            return await self._in_executor(loop, self._assemble, query, ranked_lists, started)
+        if mode == "always":
+            queries = self._build_queries(query, await self._aquery_transformer(query))
+            ranked_lists = await self._in_executor(loop, search_chunks, queries)
+            return await self._in_executor(loop, self._assemble, query, ranked_lists, started)
+
+        ranked_lists = await self._in_executor(loop, search_chunks, [query])
+        if self._needs_rewrite(mode, ranked_lists):
+            rewrites = self._build_queries(query, await self._aquery_transformer(query))[1:]
+            if rewrites:
+                ranked_lists += await self._in_executor(loop, search_chunks, rewrites)
+        return await self._in_executor(loop, self._assemble, query, ranked_lists, started)
 
 if __name__ == "__main__":
     retriever_instance = Retriever()
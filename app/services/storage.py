@@ -0,0 +1,140 @@
+from langchain_chroma.vectorstores import Chroma
+from langchain_core.embeddings import Embeddings
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import chromadb
+import threading
+import sqlite3
+import queue
+import os
+
+COLLECTION_NAME = "documents_collection"
+VECTOR_BACKENDS = ("chroma", "quantized")
+
+_lock = threading.Lock()
+_chroma_client = None
+_vector_store = None
+_sqlite_pools = {}
+
+def get_chroma_client():
+    global _chroma_client
+    with _lock:
+        if _chroma_client is None:
+            load_dotenv()
+            # Multi-worker deployments share one Chroma server instead of every process opening the directory.
+            if os.getenv("CHROMA_HOST"):
+                _chroma_client = chromadb.HttpClient(host=os.getenv("CHROMA_HOST"), port=int(os.getenv("CHROMA_PORT", "8001")))
+            else:
+                _chroma_client = chromadb.PersistentClient(path=os.path.join(os.getenv("DATA_DIR"), "chroma_db"))
+        return _chroma_client
+
+def get_vector_store(embedding_model: Embeddings) -> Chroma:
+    """Returns the process-wide collection handle, so Ingester and Retriever share one client."""
+    global _vector_store
+    client = get_chroma_client()
+    with _lock:
+        if _vector_store is None:
+            _vector_store = Chroma(
+                client=client,
+                collection_name=COLLECTION_NAME,
+                embedding_function=embedding_model
+            )
+        return _vector_store
+
+def _vector_backend():
+    load_dotenv()
+    backend = os.getenv("VECTOR_BACKEND", "chroma")
+    if backend not in VECTOR_BACKENDS:
+        raise ValueError(f"VECTOR_BACKEND must be one of {VECTOR_BACKENDS}, got '{backend}'.")
+    return backend
+
+def get_vector_collection(embedding_model: Embeddings):
+    """Returns the collection Ingester and Retriever read and write.
+
+    Both backends implement the same subset of chromadb's Collection API: the Chroma collection itself, or the
+    memory-mapped QuantizedIndex (VECTOR_BACKEND=quantized). Callers look it up on each use, since resetting the
+    Chroma collection replaces the handle.
+    """
+    if _vector_backend() == "quantized":
+        # Imported here because the quantized index builds on this module's SQLite pool.
+        from app.services.quantized_index import get_quantized_index
+        return get_quantized_index()
+    return get_vector_store(embedding_model)._collection
+
+def get_max_batch_size(embedding_model: Embeddings):
+    if _vector_backend() == "quantized":
+        return get_vector_collection(embedding_model).max_batch_size
+    return get_chroma_client().get_max_batch_size()
+
+def reset_vector_collection(embedding_model: Embeddings):
+    if _vector_backend() == "quantized":
+        return get_vector_collection(embedding_model).reset()
+    return get_vector_store(embedding_model).reset_collection()
+
+class SQLitePool:
+    """A fixed-size pool of WAL-mode connections, so readers are not serialized behind ingest status writes."""
+
+    def __init__(self, db_path: str, size: int = None, busy_timeout_ms: int = None):
+        load_dotenv()
+        self.db_path = db_path
+        self.size = size if size is not None else int(os.getenv("SQLITE_POOL_SIZE", "4"))
+        self.busy_timeout_ms = busy_timeout_ms if busy_timeout_ms is not None else int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        self.connections = queue.LifoQueue()
+        self.closed = False
+        for _ in range(self.size):
+            self.connections.put(self._connect())
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, timeout=self.busy_timeout_ms / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={self.busy_timeout_ms}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection for one transaction; it commits on success and rolls back on error."""
+        conn = self.connections.get()
+        if conn is None:
+            # close() leaves a sentinel behind, so callers fail fast instead of waiting on an empty pool.
+            self.connections.put(None)
+            raise sqlite3.ProgrammingError(f"The connection pool for {self.db_path} is closed.")
+        try:
+            with conn:
+                yield conn
+        finally:
+            if self.closed:
+                conn.close()
+            else:
+                self.connections.put(conn)
+
+    @contextmanager
+    def exclusive(self):
+        """Borrows a connection for one exclusive transaction. Schema migrations run in one, so processes
+        starting together apply them one at a time, each re-reading the schema the previous one left."""
+        with self.connection() as conn:
+            conn.execute("BEGIN EXCLUSIVE")
+            yield conn
+
+    def close(self):
+        """Closes idle connections now and borrowed ones as they are returned; never blocks."""
+        with _lock:
+            if self.closed:
+                return
+            self.closed = True
+        while True:
+            try:
+                conn = self.connections.get_nowait()
+            except queue.Empty:
+                break
+            if conn is not None:
+                conn.close()
+        self.connections.put(None)
+
+def get_sqlite_pool(db_path: str) -> SQLitePool:
+    with _lock:
+        pool = _sqlite_pools.get(db_path)
+        if pool is None or pool.closed:
+            pool = _sqlite_pools[db_path] = SQLitePool(db_path)
+        return pool
@@ -0,0 +1,7 @@
+import math
+
+# Gemini averages roughly four characters per token on English text; close enough for budgeting prompts.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
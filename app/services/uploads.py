@@ -0,0 +1,240 @@
+from fastapi import Request
+from fastapi.concurrency import run_in_threadpool
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import MultipartParser, parse_options_header
+from werkzeug.utils import secure_filename
+import itertools
+import tempfile
+import hashlib
+import tarfile
+import zipfile
+import time
+import os
+
+SUPPORTED_EXTENSIONS = (".pdf", ".docx", ".txt")
+ARCHIVE_EXTENSIONS = (".zip", ".tar", ".tar.gz", ".tgz")
+COPY_CHUNK_SIZE = 1024 * 1024
+
+class UploadTooLarge(Exception):
+    pass
+
+class MalformedUpload(Exception):
+    pass
+
+def _finalize(tmp_path: str, upload_dir: str, safe_filename: str):
+    # Uploads keep a "<name>_<timestamp>" path; a counter suffix separates uploads within the same second.
+    # Hard-linking the finished temp file fails instead of overwriting, so the final path is claimed atomically.
+    stem, ext = os.path.splitext(safe_filename)
+    base = f"{stem}_{int(time.time())}"
+    for attempt in itertools.count():
+        file_path = os.path.join(upload_dir, f"{base}_{attempt}{ext}" if attempt else f"{base}{ext}")
+        try:
+            os.link(tmp_path, file_path)
+        except FileExistsError:
+            continue
+        except OSError:
+            # Filesystems without hard links fall back to a plain rename.
+            if os.path.exists(file_path):
+                continue
+            os.replace(tmp_path, file_path)
+            return file_path
+        os.remove(tmp_path)
+        return file_path
+
+def _write_chunk(buffer, content_hash, data: bytes):
+    content_hash.update(data)
+    buffer.write(data)
+
+def _discard(tmp_path: str):
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+def save_upload_stream(stream, filename: str, upload_dir: str, max_bytes: int):
+    """Copies a file-like object into upload_dir through a temp file, returning (safe filename, stored path, sha256)."""
+    os.makedirs(upload_dir, exist_ok=True)
+    safe_filename = secure_filename(filename)
+    fd, tmp_path = tempfile.mkstemp(dir=upload_dir, prefix=".upload-", suffix=".part")
+    content_hash = hashlib.sha256()
+    size = 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            while data := stream.read(COPY_CHUNK_SIZE):
+                size += len(data)
+                if size > max_bytes:
+                    raise UploadTooLarge(f"{filename} exceeds the maximum upload size of {max_bytes} bytes.")
+                _write_chunk(buffer, content_hash, data)
+        return safe_filename, _finalize(tmp_path, upload_dir, safe_filename), content_hash.hexdigest()
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+async def _file_parts(request: Request, field_name: str, max_body_bytes: int = None):
+    """Parses a multipart request body as it arrives, yielding ("start", filename), ("data", bytes) and
+    ("end", None) events for the file parts in field_name; other fields and parts are skipped."""
+    _, params = parse_options_header(request.headers.get("content-type"))
+    if b"boundary" not in params:
+        raise MalformedUpload("Expected a multipart/form-data body.")
+    part = {"headers": {}, "field": b"", "value": b"", "active": False}
+    events = []
+
+    def on_part_begin():
+        part["headers"] = {}
+
+    def on_header_field(data: bytes, start: int, end: int):
+        part["field"] += data[start:end]
+
+    def on_header_value(data: bytes, start: int, end: int):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition"))
+        part["active"] = options.get(b"name") == field_name.encode() and b"filename" in options
+        if part["active"]:
+            events.append(("start", options[b"filename"].decode("utf-8", errors="replace")))
+
+    def on_part_data(data: bytes, start: int, end: int):
+        if not part["active"]:
+            return
+        if events and events[-1][0] == "data":
+            events[-1] = ("data", events[-1][1] + data[start:end])
+        else:
+            events.append(("data", data[start:end]))
+
+    def on_part_end():
+        if part["active"]:
+            events.append(("end", None))
+        part["active"] = False
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    # The body is counted as it arrives, so a chunked request without Content-Length is capped too.
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if max_body_bytes is not None and received > max_body_bytes:
+            raise UploadTooLarge(f"Upload exceeds the maximum size of {max_body_bytes} bytes.")
+        try:
+            parser.write(chunk)
+        except MultipartParseError as e:
+            raise MalformedUpload(f"Malformed multipart body: {e}")
+        for event in events:
+            yield event
+        events.clear()
+    parser.finalize()
+
+async def save_upload(request: Request, upload_dir: str, max_bytes: int, field_name: str = "file"):
+    """Streams the field_name file part of a multipart request straight into upload_dir.
+
+    The body is parsed as it arrives, so nothing is spooled by Starlette first; the part is hashed, capped at
+    max_bytes and written off the event loop. Returns (original filename, safe filename, stored path, sha256).
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    fd, tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=upload_dir, prefix=".upload-", suffix=".part")
+    content_hash = hashlib.sha256()
+    filename, writing, size = None, False, 0
+    try:
+        with os.fdopen(fd, "wb") as buffer:
+            async for kind, value in _file_parts(request, field_name):
+                # Only the first file in field_name is kept; later ones are read past.
+                if kind == "start":
+                    writing = filename is None
+                    filename = filename if filename is not None else value
+                elif kind == "end":
+                    writing = False
+                elif writing:
+                    size += len(value)
+                    if size > max_bytes:
+                        raise UploadTooLarge(f"{filename} exceeds the maximum upload size of {max_bytes} bytes.")
+                    await run_in_threadpool(_write_chunk, buffer, content_hash, value)
+        if filename is None:
+            raise MalformedUpload(f"The request has no file in the '{field_name}' field.")
+        safe_filename = secure_filename(filename)
+        file_path = await run_in_threadpool(_finalize, tmp_path, upload_dir, safe_filename)
+        return filename, safe_filename, file_path, content_hash.hexdigest()
+    except BaseException:
+        _discard(tmp_path)
+        raise
+
+async def save_uploads(request: Request, upload_dir: str, max_file_bytes: int, max_body_bytes: int, max_files: int, field_name: str = "files"):
+    """Streams every file part in field_name into its own temp file in upload_dir as the body arrives.
+
+    The body is capped at max_body_bytes and the part count at max_files while parsing (UploadTooLarge);
+    a part other than an archive that exceeds max_file_bytes is dropped and returned with too_large set.
+    Returns one {"filename", "tmp_path", "sha256", "too_large"} dict per part; the caller keeps or discards
+    every tmp_path, and on error none are left behind.
+    """
+    os.makedirs(upload_dir, exist_ok=True)
+    parts = []
+    current = buffer = content_hash = None
+    size = 0
+    try:
+        async for kind, value in _file_parts(request, field_name, max_body_bytes):
+            if kind == "start":
+                if len(parts) >= max_files:
+                    raise UploadTooLarge(f"Upload exceeds the maximum of {max_files} files.")
+                fd, tmp_path = await run_in_threadpool(tempfile.mkstemp, dir=upload_dir, prefix=".upload-", suffix=".part")
+                current = {"filename": value, "tmp_path": tmp_path, "sha256": None, "too_large": False}
+                parts.append(current)
+                buffer, content_hash, size = os.fdopen(fd, "wb"), hashlib.sha256(), 0
+            elif kind == "data" and buffer is not None:
+                size += len(value)
+                if size > max_file_bytes and not is_archive(current["filename"]):
+                    buffer.close()
+                    buffer = None
+                    await run_in_threadpool(_discard, current["tmp_path"])
+                    current.update(tmp_path=None, too_large=True)
+                    continue
+                await run_in_threadpool(_write_chunk, buffer, content_hash, value)
+            elif kind == "end" and current is not None:
+                if buffer is not None:
+                    buffer.close()
+                    current["sha256"] = content_hash.hexdigest()
+                current = buffer = None
+        return parts
+    except BaseException:
+        if buffer is not None:
+            buffer.close()
+        for part in parts:
+            if part["tmp_path"]:
+                _discard(part["tmp_path"])
+        raise
+
+def keep_upload(tmp_path: str, upload_dir: str, filename: str):
+    """Moves a temp file from save_uploads to its final upload path; returns (safe filename, stored path)."""
+    safe_filename = secure_filename(filename)
+    return safe_filename, _finalize(tmp_path, upload_dir, safe_filename)
+
+def discard_upload(tmp_path: str):
+    _discard(tmp_path)
+
+def is_archive(filename: str):
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def iter_archive(fileobj, filename: str):
+    """Yields (member name, file-like stream) for every regular file in a zip or tar archive."""
+    if filename.lower().endswith(".zip"):
+        with zipfile.ZipFile(fileobj) as archive:
+            for member in archive.infolist():
+                if member.is_dir():
+                    continue
+                with archive.open(member) as stream:
+                    yield os.path.basename(member.filename), stream
+    else:
+        # Stream mode reads the tar sequentially without seeking back through the upload.
+        with tarfile.open(fileobj=fileobj, mode="r|*") as archive:
+            for member in archive:
+                if member.isfile():
+                    yield os.path.basename(member.name), archive.extractfile(member)
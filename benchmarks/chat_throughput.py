@@ -0,0 +1,91 @@
+"""Closed-loop /chat load generator, for the API workers versus chat QPS curve.
+
+Usage (from the repository root, against a running server started with CACHE_MAX_SIZE=0 so every
+request runs retrieval and generation):
+    API_WORKERS=1 ./start.sh   # then, in another shell:
+    python -m benchmarks.chat_throughput --concurrency 1 4 8 16 32 --label workers=1 --output scaling.jsonl
+
+Repeat once per API_WORKERS value; every run appends one JSON line per concurrency level to --output.
+Each of the --concurrency clients sends its next question as soon as the previous answer arrives.
+"""
+from collections import Counter
+import argparse
+import asyncio
+import random
+import time
+import json
+
+from benchmarks.stats import percentiles
+
+DEFAULT_QUESTIONS = [
+    "What are the main findings of the report?",
+    "Summarize the methodology section.",
+    "Which risks are mentioned in the documents?",
+    "What recommendations are given?",
+    "Who are the stakeholders involved?",
+    "What are the key dates and deadlines?",
+    "How is performance measured?",
+    "What limitations do the authors acknowledge?",
+]
+
+async def client_loop(client, questions: list[str], rewrite_mode: str, deadline: float, latencies: list, errors: list, seed: int):
+    rng = random.Random(seed)
+    while time.perf_counter() < deadline:
+        payload = {"question": rng.choice(questions)}
+        if rewrite_mode:
+            payload["rewrite_mode"] = rewrite_mode
+        started = time.perf_counter()
+        try:
+            response = await client.post("/chat", json=payload)
+            response.raise_for_status()
+        except Exception as e:
+            errors.append(type(e).__name__)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+
+async def run_level(url: str, concurrency: int, duration: float, questions: list[str], rewrite_mode: str, timeout: float):
+    import httpx
+    latencies, errors = [], []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(
+            client_loop(client, questions, rewrite_mode, deadline, latencies, errors, seed) for seed in range(concurrency)
+        ))
+        elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency,
+        "qps": round(len(latencies) / elapsed, 2),
+        "latency_ms": percentiles(latencies),
+        "errors": len(errors),
+        "error_types": dict(Counter(errors)),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds per concurrency level")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--questions-file", help="one question per line; defaults to a small generic set")
+    parser.add_argument("--rewrite-mode", choices=["off", "always", "adaptive", "pipelined"])
+    parser.add_argument("--label", default="", help="recorded with every result, e.g. workers=4")
+    parser.add_argument("--output", help="append the results as JSON lines to this path")
+    args = parser.parse_args()
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions_file:
+        with open(args.questions_file, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+
+    for concurrency in args.concurrency:
+        result = {"label": args.label, "rewrite_mode": args.rewrite_mode, "duration": args.duration}
+        result.update(asyncio.run(run_level(args.url, concurrency, args.duration, questions, args.rewrite_mode, args.timeout)))
+        print(json.dumps(result))
+        if args.output:
+            with open(args.output, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+
+if __name__ == "__main__":
+    main()
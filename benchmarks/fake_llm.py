@@ -0,0 +1,46 @@
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from typing import Optional
+import hashlib
+import asyncio
+import time
+import re
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic offline stand-in for ChatGoogleGenerativeAI.
+
+    Accepts the same constructor arguments the services pass to Gemini. Query-rewrite prompts get three
+    paraphrases of the original question; every other prompt gets a fixed-length answer derived from its hash.
+    """
+
+    model: str = "fake"
+    temperature: float = 0.0
+    google_api_key: Optional[str] = None
+    latency_ms: float = 0.0
+    answer_words: int = 60
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat"
+
+    def _respond(self, prompt: str):
+        match = re.search(r"Original question: (.*)", prompt, re.DOTALL)
+        if match and "different versions" in prompt:
+            question = match.group(1).strip()
+            return f"{question}\nExplain {question.lower()}\nWhat do the documents say about {question.lower()}"
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return " ".join(digest[i % 56:i % 56 + 8] for i in range(self.answer_words))
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+        text = self._respond("\n".join(str(message.content) for message in messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        # Like the Gemini client, the async path waits without holding one of the event loop's executor threads.
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        text = self._respond("\n".join(str(message.content) for message in messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
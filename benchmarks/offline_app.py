@@ -0,0 +1,56 @@
+"""The API with the offline substitutions of rag_benchmark, as an ASGI app for multi-process load tests.
+
+Usage (from the repository root):
+    python -m benchmarks.offline_app --seed-chunks 20000     # fills DATA_DIR (or CHROMA_HOST) with synthetic chunks
+    APP_MODULE=benchmarks.offline_app:app API_WORKERS=4 ./start.sh
+
+Gemini is replaced by FakeChatModel with BENCH_LLM_LATENCY_MS of simulated latency per call. With
+BENCH_FAKE_EMBEDDINGS=1, MiniLM is replaced by deterministic vectors, e.g. where the model cannot be downloaded;
+retrieval quality is then meaningless, but the serving path (HTTP, Chroma, SQLite, fusion) is measured as is.
+"""
+from functools import partial
+import argparse
+import random
+import os
+
+from benchmarks.fake_llm import FakeChatModel
+import app.services.context_builder as context_builder_module
+import app.services.generation as generation_module
+import app.services.retriever as retriever_module
+
+def use_offline_models(app_main, llm_latency_ms: float = 0.0, fake_embeddings: bool = False):
+    fake_llm = partial(FakeChatModel, latency_ms=llm_latency_ms)
+    for module in (context_builder_module, generation_module, retriever_module):
+        module.ChatGoogleGenerativeAI = fake_llm
+    if fake_embeddings:
+        from langchain_core.embeddings import DeterministicFakeEmbedding
+        app_main.HuggingFaceEmbeddings = lambda model_name: DeterministicFakeEmbedding(size=384)
+
+os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+import app.main as app_main
+use_offline_models(
+    app_main,
+    llm_latency_ms=float(os.getenv("BENCH_LLM_LATENCY_MS", "0")),
+    fake_embeddings=os.getenv("BENCH_FAKE_EMBEDDINGS", "").lower() in ("1", "true", "yes")
+)
+app = app_main.app
+
+def seed_chunks(count: int, seed: int, batch_size: int = 1000):
+    """Writes synthetic chunks straight to the vector store and the lexical index, without conversion."""
+    from benchmarks.rag_benchmark import WORDS
+    rng = random.Random(seed)
+    ingester = app_main.get_ingester()
+    for start in range(0, count, batch_size):
+        ids = [f"seed-{i}" for i in range(start, min(start + batch_size, count))]
+        texts = [" ".join(rng.choice(WORDS) for _ in range(120)) + "." for _ in ids]
+        metadatas = [{"source": f"/seed/doc_{i // 20:05d}.md", "filename": f"doc_{i // 20:05d}.md", "chunk_index": i % 20} for i in range(start, start + len(ids))]
+        ingester.collection.add(ids=ids, documents=texts, metadatas=metadatas, embeddings=ingester.embedding_model.embed_documents(texts))
+        ingester.lexical_index.add(ids, texts, metadatas)
+    return ingester.collection.count()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed-chunks", type=int, required=True)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    print(f"The collection now holds {seed_chunks(args.seed_chunks, args.seed)} chunks.")
@@ -0,0 +1,197 @@
+"""Offline RAG benchmark: synthetic corpus -> Ingester -> /chat replay with a fake chat model.
+
+Usage (from the repository root):
+    python -m benchmarks.rag_benchmark --docs 200 --questions 100 --output bench.json
+
+Nothing leaves the machine except the first download of the local embedding and reranker models;
+pass --fake-embeddings to skip the embedding model entirely (recall is then meaningless for dense search).
+"""
+import argparse
+import tempfile
+import threading
+import logging
+import random
+import json
+import time
+import sys
+import os
+
+from benchmarks.stats import percentiles
+
+WORDS = (
+    "archive ledger vector kernel beacon harbor quartz meadow signal cobalt lantern orbit summit canyon "
+    "ember glacier prism relay falcon cipher delta mosaic nimbus pylon raven saffron tundra umbra willow "
+    "zephyr anchor bramble cinder drift fathom garnet hollow ivory jasper kestrel lumen marrow nectar"
+).split()
+
+class PeakRSS:
+    """Samples the process RSS on a background thread; psutil keeps this portable to Windows."""
+
+    def __init__(self, interval: float = 0.05):
+        import psutil
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = self.process.memory_info().rss
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.peak = max(self.peak, self.process.memory_info().rss)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+class StageCapture(logging.Handler):
+    """Collects the per-stage timings the chat endpoints attach to their "Chat response generated" log."""
+
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        if record.getMessage() == "Chat response generated" and hasattr(record, "extra"):
+            self.records.append(record.extra)
+
+def generate_corpus(corpus_dir: str, docs: int, sections: int, seed: int):
+    """Writes markdown documents that each hide one unique fact; returns (question, answer filename) pairs."""
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    facts = []
+    for i in range(docs):
+        project = f"{rng.choice(WORDS)}-{i}"
+        code = f"{rng.randrange(16 ** 6):06X}"
+        filename = f"doc_{i:05d}.md"
+        fact_section = rng.randrange(sections)
+        lines = [f"# Report {i}: {project}", ""]
+        for section in range(sections):
+            lines += [f"## Section {section + 1}", ""]
+            for _ in range(3):
+                lines.append(" ".join(rng.choice(WORDS) for _ in range(60)) + ".")
+            if section == fact_section:
+                lines.append(f"The activation code for project {project} is {code}.")
+            lines.append("")
+        with open(os.path.join(corpus_dir, filename), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        facts.append((f"What is the activation code for project {project}?", filename))
+    return facts
+
+def run_ingest(ingester, corpus_dir: str, batch_size: int):
+    paths = sorted(os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir))
+    prepare_ms, write_ms, chunks = [], [], 0
+    started = time.perf_counter()
+    for start in range(0, len(paths), batch_size):
+        batch = paths[start:start + batch_size]
+        t0 = time.perf_counter()
+        prepared = ingester.prepare_many([(path, os.path.basename(path)) for path in batch])
+        t1 = time.perf_counter()
+        failed = [p["path"] for p in prepared if "error" in p]
+        if failed:
+            raise RuntimeError(f"Benchmark corpus failed to convert: {failed[:3]}")
+        summaries = ingester.write_many([(p, None) for p in prepared])
+        t2 = time.perf_counter()
+        prepare_ms.append((t1 - t0) * 1000)
+        write_ms.append((t2 - t1) * 1000)
+        chunks += sum(summary["chunks"] for summary in summaries)
+    elapsed = time.perf_counter() - started
+    return {
+        "documents": len(paths),
+        "chunks": chunks,
+        "seconds": round(elapsed, 2),
+        "docs_per_sec": round(len(paths) / elapsed, 2),
+        "chunks_per_sec": round(chunks / elapsed, 2),
+        "prepare_batch_ms": percentiles(prepare_ms),
+        "write_batch_ms": percentiles(write_ms),
+    }
+
+def replay_chat(client, facts: list[tuple], rewrite_mode: str, k: int, capture: StageCapture):
+    """Asks every question through /chat; returns (recall@k, latency percentiles per stage).
+
+    A hit is the answer's file among the first k citations of the response, so recall covers everything a
+    production request goes through: the response cache, history, filters, rewrites, reranking and the
+    context budget.
+    """
+    request_ms, hits = [], 0
+    for question, answer in facts:
+        t0 = time.perf_counter()
+        res = client.post("/chat", json={"question": question, "rewrite_mode": rewrite_mode})
+        request_ms.append((time.perf_counter() - t0) * 1000)
+        res.raise_for_status()
+        hits += answer in res.json()["citations"][:k]
+    stages = {"request_ms": percentiles(request_ms)}
+    for stage in ("retrieval_ms", "rerank_ms", "generation_ms", "prompt_tokens"):
+        values = [record[stage] for record in capture.records if record.get(stage) is not None]
+        if values:
+            stages[stage] = percentiles(values)
+    # Span timings (embedding, vector and lexical search, rewrites, history) from each request's log line.
+    spans = sorted({name for record in capture.records for name in record.get("stages_ms") or {}})
+    for name in spans:
+        stages[f"{name}_ms"] = percentiles([record["stages_ms"][name] for record in capture.records if name in (record.get("stages_ms") or {})])
+    return (round(hits / len(facts), 4) if facts else None), stages
+
+def print_stages(stages: dict):
+    print(f"{'stage':<28}{'p50':>10}{'p95':>10}", file=sys.stderr)
+    for stage, summary in stages.items():
+        if summary.get("count"):
+            print(f"{stage:<28}{summary['p50']:>10}{summary['p95']:>10}", file=sys.stderr)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--docs", type=int, default=200)
+    parser.add_argument("--sections", type=int, default=5)
+    parser.add_argument("--questions", type=int, default=100)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--batch-size", type=int, default=16)
+    parser.add_argument("--rewrite-mode", default="off", choices=["off", "always", "adaptive", "pipelined"])
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="simulated Gemini latency per call")
+    parser.add_argument("--fake-embeddings", action="store_true")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--data-dir", help="defaults to a fresh temporary directory")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    # The app reads its configuration at import time, so the environment is prepared first.
+    data_dir = args.data_dir or tempfile.mkdtemp(prefix="rag-bench-")
+    os.environ["DATA_DIR"] = data_dir
+    os.environ.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    os.environ.setdefault("INGEST_WORKERS", "0")
+    os.environ.setdefault("RECONCILE_INTERVAL_SECONDS", "0")
+
+    os.environ["BENCH_LLM_LATENCY_MS"] = str(args.llm_latency_ms)
+    os.environ["BENCH_FAKE_EMBEDDINGS"] = "1" if args.fake_embeddings else ""
+    from benchmarks.offline_app import app_main
+
+    app_logger = logging.getLogger("app")
+    for handler in app_logger.handlers:
+        handler.setLevel(logging.WARNING)
+    capture = StageCapture()
+    app_logger.addHandler(capture)
+
+    from fastapi.testclient import TestClient
+    results = {"config": vars(args) | {"data_dir": data_dir}}
+    with PeakRSS() as rss:
+        facts = generate_corpus(os.path.join(data_dir, "bench_corpus"), args.docs, args.sections, args.seed)
+        results["ingest"] = run_ingest(app_main.get_ingester(), os.path.join(data_dir, "bench_corpus"), args.batch_size)
+
+        questions = random.Random(args.seed).sample(facts, min(args.questions, len(facts)))
+        with TestClient(app_main.app) as client:
+            while client.get("/ready").status_code != 200:
+                if app_main.startup_state["error"]:
+                    raise RuntimeError(f"Startup failed: {app_main.startup_state['error']}")
+                time.sleep(0.2)
+            results[f"recall@{args.k}"], results["chat"] = replay_chat(client, questions, args.rewrite_mode, args.k, capture)
+    results["peak_rss_mb"] = round(rss.peak / (1024 * 1024), 1)
+
+    print_stages(results["chat"])
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
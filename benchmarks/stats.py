@@ -0,0 +1,7 @@
+def percentiles(values: list[float], digits: int = 2):
+    """Nearest-rank p50/p95/p99 of values, with their count."""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+    return {"count": len(ordered), "p50": round(pick(0.50), digits), "p95": round(pick(0.95), digits), "p99": round(pick(0.99), digits)}
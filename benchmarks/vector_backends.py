@@ -0,0 +1,146 @@
+"""Recall versus latency and memory: Chroma's HNSW collection against the quantized index.
+
+Usage (from the repository root):
+    python -m benchmarks.vector_backends --vectors 50000 --queries 200 --output vectors.json
+    python -m benchmarks.vector_backends --from-chroma   # the existing DATA_DIR collection as the corpus
+
+Recall@k is measured against an exact float32 search. Every build and every query run happens in a fresh
+process, so serving_rss_mb is what opening the index and answering the queries adds to a process.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import argparse
+import tempfile
+import time
+import json
+import os
+
+from benchmarks.stats import percentiles
+
+BATCH_SIZE = 5000
+
+def directory_mb(path: str):
+    return round(sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names) / (1024 * 1024), 1)
+
+def synthetic_corpus(vectors: int, dim: int, clusters: int, seed: int):
+    # Unit vectors around a few hundred topics, roughly how MiniLM chunk embeddings are distributed.
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    corpus = centers[rng.integers(0, clusters, vectors)] + 0.6 * rng.normal(size=(vectors, dim))
+    return (corpus / np.linalg.norm(corpus, axis=1, keepdims=True)).astype(np.float32)
+
+def chroma_corpus():
+    import numpy as np
+    from app.services.storage import COLLECTION_NAME, get_chroma_client
+    collection = get_chroma_client().get_or_create_collection(COLLECTION_NAME)
+    pages = []
+    offset = 0
+    while True:
+        page = collection.get(limit=BATCH_SIZE, offset=offset, include=["embeddings"])
+        if not len(page["ids"]):
+            break
+        pages.append(np.asarray(page["embeddings"], dtype=np.float32))
+        offset += len(page["ids"])
+    if not pages:
+        raise RuntimeError("The Chroma collection is empty.")
+    return np.concatenate(pages)
+
+def exact_neighbours(corpus, queries, k: int):
+    import numpy as np
+    distances = (corpus ** 2).sum(axis=1)[None, :] - 2 * queries @ corpus.T
+    return np.argsort(distances, axis=1)[:, :k]
+
+def _open(backend: str, directory: str, dtype: str = None, rescore: bool = True):
+    if backend == "chroma":
+        import chromadb
+        return chromadb.PersistentClient(path=directory).get_or_create_collection("benchmark", metadata={"hnsw:space": "l2"})
+    from app.services.quantized_index import QuantizedIndex
+    return QuantizedIndex(directory=directory, dtype=dtype, rescore=rescore)
+
+def build(backend: str, directory: str, corpus_path: str, dtype: str = None):
+    import numpy as np
+    corpus = np.load(corpus_path, mmap_mode="r")
+    collection = _open(backend, directory, dtype)
+    started = time.perf_counter()
+    for start in range(0, len(corpus), BATCH_SIZE):
+        batch = np.asarray(corpus[start:start + BATCH_SIZE])
+        collection.add(ids=[f"v{i}" for i in range(start, start + len(batch))], embeddings=batch.tolist())
+    return round(time.perf_counter() - started, 2)
+
+def serve(backend: str, directory: str, queries_path: str, k: int, dtype: str = None, rescore: bool = True):
+    import numpy as np
+    import psutil
+    import chromadb
+    from app.services.quantized_index import QuantizedIndex
+    # Both backends' modules are imported before the baseline, so only the index itself is measured.
+    queries = np.load(queries_path)
+    process = psutil.Process()
+    baseline = process.memory_info().rss
+    collection = _open(backend, directory, dtype, rescore)
+    collection.query(query_embeddings=[queries[0].tolist()], n_results=k)
+    latencies, ids = [], []
+    for query in queries:
+        started = time.perf_counter()
+        result = collection.query(query_embeddings=[query.tolist()], n_results=k, include=["distances"])
+        latencies.append((time.perf_counter() - started) * 1000)
+        ids.append([int(chunk_id[1:]) for chunk_id in result["ids"][0]])
+    return {"latencies": latencies, "ids": ids, "rss_mb": round((process.memory_info().rss - baseline) / (1024 * 1024), 1)}
+
+def run_isolated(func, *args):
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(func, *args).result()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=50000)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--clusters", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--from-chroma", action="store_true", help="use the vectors of the existing Chroma collection")
+    parser.add_argument("--output", help="write the results as JSON to this path")
+    args = parser.parse_args()
+
+    import numpy as np
+    corpus = chroma_corpus() if args.from_chroma else synthetic_corpus(args.vectors, args.dim, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed)
+    # Queries are perturbed corpus vectors, so each has a dense neighbourhood like a real question does.
+    queries = corpus[rng.choice(len(corpus), min(args.queries, len(corpus)), replace=False)]
+    queries = queries + 0.3 * rng.normal(size=queries.shape).astype(np.float32) / np.sqrt(corpus.shape[1])
+    truth = exact_neighbours(corpus, queries, args.k)
+
+    work_dir = tempfile.mkdtemp(prefix="vector-bench-")
+    corpus_path, queries_path = os.path.join(work_dir, "corpus.npy"), os.path.join(work_dir, "queries.npy")
+    np.save(corpus_path, corpus)
+    np.save(queries_path, queries.astype(np.float32))
+
+    variants = [("chroma", None, True)] + [("quantized", dtype, rescore) for dtype in ("int8", "float16") for rescore in (True, False)]
+    results = {"config": {**vars(args), "vectors": len(corpus), "dim": corpus.shape[1]}, "backends": []}
+    built = {}
+    for backend, dtype, rescore in variants:
+        key = (backend, dtype)
+        directory = os.path.join(work_dir, f"{backend}-{dtype or 'hnsw'}")
+        if key not in built:
+            built[key] = run_isolated(build, backend, directory, corpus_path, dtype)
+        served = run_isolated(serve, backend, directory, queries_path, args.k, dtype, rescore)
+        recall = np.mean([len(set(found) & set(expected)) / args.k for found, expected in zip(served["ids"], truth.tolist())])
+        results["backends"].append({
+            "backend": backend,
+            "dtype": dtype or "float32",
+            "rescore": rescore if backend == "quantized" else None,
+            f"recall@{args.k}": round(float(recall), 4),
+            "query_ms": percentiles(served["latencies"], digits=3),
+            "build_seconds": built[key],
+            "disk_mb": directory_mb(directory),
+            "serving_rss_mb": served["rss_mb"],
+        })
+        print(json.dumps(results["backends"][-1]))
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
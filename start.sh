@@ -1,8 +1,64 @@
 #!/bin/bash
 
-# Start FastAPI server in the background
-echo "Starting FastAPI server..."
-python -m uvicorn app.main:app --host 0.0.0.0 --port 8000 &
+# Load .env so the Chroma server below sees DATA_DIR as well.
+set -a
+[ -f .env ] && . ./.env
+set +a
+
+API_WORKERS=${API_WORKERS:-1}
+APP_MODULE=${APP_MODULE:-app.main:app}
+
+if [ "$API_WORKERS" -gt 1 ]; then
+    # Multi-worker mode: a Chroma server owns the index directory, a single writer process ingests and
+    # maintains the index, and API_WORKERS reader processes serve chat and reads on port 8000.
+
+    # Split the cores explicitly: INGEST_CPUS for the ingest worker processes, the rest shared by the API
+    # workers, so MiniLM in N+M processes does not each start one torch thread per core.
+    CPUS=$(nproc)
+    INGEST_WORKERS=${INGEST_WORKERS:-2}
+    INGEST_CPUS=${INGEST_CPUS:-$(( CPUS / 4 > 0 ? CPUS / 4 : 1 ))}
+    READER_CPUS=$(( CPUS - INGEST_CPUS > API_WORKERS ? CPUS - INGEST_CPUS : API_WORKERS ))
+    READER_EMBED_THREADS=$(( READER_CPUS / API_WORKERS ))
+    if [ "$INGEST_WORKERS" -gt 0 ]; then
+        # The writer process itself only writes to the index; its worker processes embed.
+        WRITER_EMBED_THREADS=1
+        INGEST_EMBED_THREADS=$(( INGEST_CPUS / INGEST_WORKERS > 0 ? INGEST_CPUS / INGEST_WORKERS : 1 ))
+    else
+        WRITER_EMBED_THREADS=$INGEST_CPUS
+        INGEST_EMBED_THREADS=$INGEST_CPUS
+    fi
+
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/rag-metrics}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+    echo "Starting Chroma server..."
+    chroma run --path "$DATA_DIR/chroma_db" --host 127.0.0.1 --port 8001 &
+    until curl -sf http://127.0.0.1:8001/api/v2/heartbeat > /dev/null; do sleep 1; done
+
+    echo "Starting ingestion writer..."
+    APP_ROLE=writer CHROMA_HOST=127.0.0.1 CHROMA_PORT=8001 INGEST_WORKERS=$INGEST_WORKERS \
+        EMBED_THREADS=$WRITER_EMBED_THREADS INGEST_EMBED_THREADS=$INGEST_EMBED_THREADS \
+        python -m uvicorn "$APP_MODULE" --host 127.0.0.1 --port 8002 &
+    WRITER_PID=$!
+
+    # The writer migrates the databases and recovers ingest jobs before it is ready; readers start after it.
+    until curl -sf http://127.0.0.1:8002/ready > /dev/null; do
+        if ! kill -0 "$WRITER_PID" 2> /dev/null || curl -s http://127.0.0.1:8002/ready | grep -q '"status":"failed"'; then
+            echo "Ingestion writer failed to start." >&2
+            exit 1
+        fi
+        sleep 1
+    done
+
+    echo "Starting $API_WORKERS API workers..."
+    APP_ROLE=reader CHROMA_HOST=127.0.0.1 CHROMA_PORT=8001 WRITER_URL=http://127.0.0.1:8002 WEB_CONCURRENCY=$API_WORKERS \
+        EMBED_THREADS=$READER_EMBED_THREADS \
+        python -m uvicorn "$APP_MODULE" --host 0.0.0.0 --port 8000 --workers "$API_WORKERS" &
+else
+    # Start FastAPI server in the background
+    echo "Starting FastAPI server..."
+    python -m uvicorn "$APP_MODULE" --host 0.0.0.0 --port 8000 &
+fi
 
 # Start Streamlit UI
 echo "Starting Streamlit UI..."
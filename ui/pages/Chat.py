@@ -16,17 +16,48 @@ API_URL = os.getenv("API_URL", "http://localhost:8000/")
 st.set_page_config(page_title="Chat App", page_icon="💬", layout="wide")
 load_css()
 
+def create_session():
+    try:
+        res = requests.post(API_URL + "sessions")
+        if res.status_code == 200:
+            return res.json()["session_id"]
+    except requests.exceptions.RequestException:
+        pass
+    st.error("⚠️ Could not connect to the backend. Please try again later.")
+    st.stop()
+
+def load_session(session_id):
+    try:
+        res = requests.get(API_URL + f"sessions/{session_id}")
+        if res.status_code == 200:
+            return res.json()["messages"]
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
+# The conversation lives on the server; the session ID in the URL lets it survive reloads.
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("session")
+    messages = load_session(session_id) if session_id else None
+    if messages is None:
+        session_id, messages = create_session(), []
+    st.session_state.session_id = session_id
+    st.session_state.messages = messages
+st.query_params["session"] = st.session_state.session_id
+
 col_title, col_btn = st.columns([0.8, 0.2])
 with col_title:
     st.markdown('<h1 class="gradient-text">💬 Chat Interface</h1>', unsafe_allow_html=True)
 with col_btn:
     if st.button("Clear History", type="primary"):
+        try:
+            requests.delete(API_URL + f"sessions/{st.session_state.session_id}")
+        except requests.exceptions.RequestException:
+            pass
+        st.session_state.session_id = create_session()
         st.session_state.messages = []
         st.rerun()
 
-if "messages" not in st.session_state:
-    st.session_state.messages = []
-
 # Chat container
 chat_container = st.container()
 
@@ -34,6 +65,8 @@ with chat_container:
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
+            if message.get("citations"):
+                st.caption("Sources: " + ", ".join(message["citations"]))
 
 if prompt := st.chat_input("Ask a question about your documents..."):
     st.session_state.messages.append(
@@ -44,27 +77,42 @@ if prompt := st.chat_input("Ask a question about your documents..."):
         st.markdown(prompt)
 
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            res = None
-            try:
-                res = requests.post(
-                    API_URL+"chat",
-                    json={"question": prompt, "history": json.dumps(st.session_state.messages)}
-                )
-            except requests.exceptions.RequestException:
-                st.error("⚠️ Could not connect to the backend. Please try again later.")
-                st.stop()
-
-            if res is None:
-                st.stop()
-            
-            if res.status_code == 200:
-                reply = res.json()["response"]
-            else:
-                reply = "Sorry, something went wrong. Please try again later."
-
-            st.session_state.messages.append(
-                {"role": "assistant", "content": reply}
+        citations = []
+
+        def stream_reply(res):
+            for line in res.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "citations":
+                    citations.extend(event["citations"])
+                elif event["type"] == "token":
+                    yield event["content"]
+                elif event["type"] == "error":
+                    yield "Sorry, something went wrong. Please try again later."
+
+        res = None
+        try:
+            res = requests.post(
+                API_URL+"chat/stream",
+                json={"question": prompt, "session_id": st.session_state.session_id},
+                stream=True
             )
+        except requests.exceptions.RequestException:
+            st.error("⚠️ Could not connect to the backend. Please try again later.")
+            st.stop()
+
+        if res is None:
+            st.stop()
+
+        if res.status_code == 200:
+            reply = st.write_stream(stream_reply(res))
+            if citations:
+                st.caption("Sources: " + ", ".join(citations))
+        else:
+            reply = "Sorry, something went wrong. Please try again later."
             st.markdown(reply)
 
+        st.session_state.messages.append(
+            {"role": "assistant", "content": reply, "citations": citations}
+        )
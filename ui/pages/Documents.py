@@ -17,24 +17,38 @@ load_css()
 
 st.markdown('<h1 class="gradient-text">📄 Document Management</h1>', unsafe_allow_html=True)
 
-def fetch_documents():
+PAGE_SIZE = 50
+STATUS_FILTERS = ["All", "uploaded", "queued", "converting", "embedding", "ingested", "failed"]
+
+def fetch_documents(cursor=None, query="", status=None):
+    params = {"limit": PAGE_SIZE, "cursor": cursor, "q": query or None, "status": status}
     try:
-        res = requests.get(API_URL + "documents")
+        res = requests.get(API_URL + "documents", params=params)
         if res.status_code == 200:
-            return res.json().get("documents", [])
+            body = res.json()
+            return body.get("documents", []), body.get("next_cursor")
     except Exception:
         st.error("Failed to fetch documents from the server.")
-    return []
+    return [], None
 
-def upload_document(file):
-    files = {"file": (file.name, file.getvalue(), file.type)}
+def upload_documents(files):
+    payload = [("files", (file.name, file.getvalue(), file.type)) for file in files]
     try:
-        res=requests.post(API_URL + "document", files=files)
+        res=requests.post(API_URL + "documents/bulk", files=payload)
     except requests.exceptions.RequestException:
         st.error("⚠️ Could not connect to the backend. Please try again later.")
         return None
     return res
 
+def fetch_batch_progress(batch_id):
+    try:
+        res = requests.get(API_URL + f"documents/bulk/{batch_id}")
+        if res.status_code == 200:
+            return res.json()
+    except requests.exceptions.RequestException:
+        pass
+    return None
+
 def delete_document(name):
     try:
         res=requests.delete(API_URL + f"document", json={"source": name})
@@ -44,52 +58,76 @@ def delete_document(name):
     return res
 
 # Upload Section
-st.subheader("📤 Upload Document")
+st.subheader("📤 Upload Documents")
 st.markdown("""
     <div style="background: rgba(255, 255, 255, 0.05); padding: 20px; border-radius: 12px; border: 1px dashed rgba(255, 255, 255, 0.2); margin-bottom: 20px;">
-        <p style="margin: 0; color: #aaa;">Supported formats: PDF, DOCX, TXT</p>
+        <p style="margin: 0; color: #aaa;">Supported formats: PDF, DOCX, TXT, or ZIP/TAR archives of them</p>
     </div>
 """, unsafe_allow_html=True)
 
-uploaded_file = st.file_uploader(
-    "Choose a file",
-    type=["pdf", "docx", "txt"],
+uploaded_files = st.file_uploader(
+    "Choose files",
+    type=["pdf", "docx", "txt", "zip", "tar", "tgz", "gz"],
+    accept_multiple_files=True,
     label_visibility="collapsed"
 )
 
-if uploaded_file:
+if uploaded_files:
     if st.button("Upload and Ingest", type="primary"):
-        with st.spinner("Uploading and ingesting document..."):
-            res = upload_document(uploaded_file)
+        with st.spinner("Uploading documents..."):
+            res = upload_documents(uploaded_files)
 
             if res is None:
-                pass  # Error already shown by upload_document
+                pass  # Error already shown by upload_documents
             elif res.status_code == 200:
-                st.success("✅ Document uploaded successfully")
+                result = res.json()
+                st.session_state.batch_id = result["batch_id"]
+                st.success(f"✅ {result['accepted']} document(s) queued for ingestion")
+                skipped = [f"{item['filename']}: {item['message']}" for item in result["files"] if "job_id" not in item]
+                if skipped:
+                    st.info("\n".join(skipped))
             else:
-                st.error("❌ Failed to upload document")
+                st.error("❌ Failed to upload documents")
+
+if st.session_state.get("batch_id"):
+    progress = fetch_batch_progress(st.session_state.batch_id)
+    if progress:
+        finished = progress["ingested"] + progress["failed"]
+        st.progress(
+            finished / progress["total"],
+            text=f"Batch #{progress['batch_id']}: {progress['ingested']}/{progress['total']} ingested, "
+                 f"{progress['failed']} failed, {progress['chunks']} chunks"
+        )
+        if finished < progress["total"] and st.button("Refresh progress"):
+            st.rerun()
 
 st.divider()
 
 # Documents List
 st.subheader("📄 Available Documents")
 
-search_col, _ = st.columns([1, 1])
+search_col, status_col, _ = st.columns([2, 1, 1])
 with search_col:
     search_query = st.text_input(   
         "",
         placeholder="🔍 Search documents...",
         label_visibility="collapsed"
     )
+with status_col:
+    status_filter = st.selectbox("Status", STATUS_FILTERS, label_visibility="collapsed")
 
-with st.spinner("Fetching documents..."):
-    documents = fetch_documents()
+# Pages are fetched by cursor; the stack of cursors seen so far lets "Previous" step back.
+filters = (search_query, status_filter)
+if st.session_state.get("document_filters") != filters:
+    st.session_state.document_filters = filters
+    st.session_state.document_cursors = [None]
 
-if search_query:
-    documents = [
-        doc for doc in documents
-        if search_query.lower() in doc[0].lower()
-    ]
+with st.spinner("Fetching documents..."):
+    documents, next_cursor = fetch_documents(
+        cursor=st.session_state.document_cursors[-1],
+        query=search_query,
+        status=None if status_filter == "All" else status_filter
+    )
 
 if not documents:
     st.info("No documents available.")
@@ -105,10 +143,14 @@ else:
     """, unsafe_allow_html=True)
 
     for idx, doc in enumerate(documents):
-        filename, status, timestamp, path = doc
+        filename, status, timestamp, path, document_id = doc
         
-        status_class = "status-ingested" if status == "ingested" else "status-pending"
-        status_display = f"✅ {status.capitalize()}" if status == "ingested" else f"⏳ {status.capitalize()}"
+        if status == "ingested":
+            status_class, status_display = "status-ingested", f"✅ {status.capitalize()}"
+        elif status == "failed":
+            status_class, status_display = "status-failed", f"❌ {status.capitalize()}"
+        else:
+            status_class, status_display = "status-pending", f"⏳ {status.capitalize()}"
 
         col1, col2, col3, col4 = st.columns([3, 2, 2, 1])
         
@@ -132,3 +174,16 @@ else:
                         st.error("Failed to delete")
         
         st.markdown("<hr style='margin: 5px 0; border-color: rgba(255,255,255,0.05);'>", unsafe_allow_html=True)
+
+page = len(st.session_state.document_cursors)
+prev_col, page_col, next_col = st.columns([1, 2, 1])
+with prev_col:
+    if page > 1 and st.button("← Previous"):
+        st.session_state.document_cursors.pop()
+        st.rerun()
+with page_col:
+    st.markdown(f"<div style='text-align: center; color: #aaa; padding-top: 5px;'>Page {page}</div>", unsafe_allow_html=True)
+with next_col:
+    if next_cursor and st.button("Next →"):
+        st.session_state.document_cursors.append(next_cursor)
+        st.rerun()